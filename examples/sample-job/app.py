@@ -14,6 +14,7 @@ import os
 import sys
 import json
 import logging
+import tempfile
 from datetime import datetime
 from typing import Dict, Any
 import boto3
@@ -28,6 +29,13 @@ from utils import (
     download_from_s3,
     upload_to_s3
 )
+from s3_codecs import codec_stats
+from s3_concurrency import get_controller
+from memory_governor import MemoryGovernor, SpillBuffer
+from output_sink import CoalescingSink
+from job_profiler import Profiler
+from external_sort import ExternalGroupBy, ExternalSorter
+from reference_index import ReferenceIndex, ensure_index
 
 
 # Initialize logger
@@ -54,7 +62,39 @@ class BatchJob:
         self.output_path = os.getenv('OUTPUT_PATH', '')
         self.processing_mode = os.getenv('PROCESSING_MODE', 'standard')
         
-        # Initialize AWS clients
+        # Compression codecs ('auto' picks from the file extension)
+        self.input_codec = os.getenv('INPUT_CODEC', 'auto')
+        self.output_codec = os.getenv('OUTPUT_CODEC', 'auto')
+        level = os.getenv('COMPRESSION_LEVEL')
+        self.compression_level = int(level) if level else None
+        
+        # Coalesced output: results roll into objects of this size/age
+        self.output_object_size = int(os.getenv('OUTPUT_OBJECT_SIZE_MB', '128')) * 1024 * 1024
+        self.output_max_age = float(os.getenv('OUTPUT_MAX_AGE', '300'))
+        # Buffer output on local scratch rather than in memory
+        self.output_spool = os.getenv('OUTPUT_SPOOL', 'true').lower() == 'true'
+        self.output_sink = None
+        
+        # Profiling (PROFILE_MODE=cprofile,sampling,tracemalloc)
+        self.profiler = Profiler.from_env(self.job_id, self.output_path)
+        
+        # Memory budget: batch sizes shrink and buffers spill to scratch
+        # as RSS approaches the container limit
+        self.batch_size = int(os.getenv('BATCH_SIZE', '1000'))
+        self.scratch_dir = os.getenv('SCRATCH_DIR', tempfile.gettempdir())
+        self.memory_governor = MemoryGovernor()
+        
+        # Shared memory-mapped lookup table, built or downloaded once per host
+        self.reference_index_path = os.getenv(
+            'REFERENCE_INDEX_PATH',
+            os.path.join(self.scratch_dir, 'reference.idx')
+        )
+        self.reference_index_source = os.getenv('REFERENCE_INDEX_SOURCE', '')
+        self.reference_index = None
+        
+        # Initialize AWS clients. The S3 helpers in utils share a client
+        # whose retries are left to the adaptive concurrency controller;
+        # this one keeps botocore's retries for direct calls
         self.s3_client = boto3.client('s3', region_name=self.aws_region)
         self.cloudwatch_client = boto3.client('cloudwatch', region_name=self.aws_region)
         
@@ -116,6 +156,53 @@ class BatchJob:
             logger.error(f"Error loading secrets: {e}")
             raise
     
+    def open_output_sink(self, extension: str = '.jsonl.gz') -> CoalescingSink:
+        """
+        Open a coalescing sink that writes results under OUTPUT_PATH.
+        
+        Args:
+            extension: Object extension (also selects the compression codec)
+            
+        Returns:
+            Sink accepting one result per write() call
+        """
+        name_prefix = self.job_id.replace(':', '-')
+        self.output_sink = CoalescingSink(
+            self.output_path,
+            object_size=self.output_object_size,
+            max_age=self.output_max_age,
+            extension=extension,
+            spool_dir=self.scratch_dir if self.output_spool else None,
+            name_prefix=name_prefix,
+            governor=self.memory_governor,
+            region=self.aws_region
+        )
+        return self.output_sink
+    
+    def open_reference_index(self, builder=None) -> ReferenceIndex:
+        """
+        Open the host-wide reference index for enrichment lookups.
+        
+        The first worker on a host downloads REFERENCE_INDEX_SOURCE (or runs
+        the builder) into REFERENCE_INDEX_PATH; every worker then maps the
+        same file, sharing its page-cache pages.
+        
+        Args:
+            builder: Callable returning (key, value) pairs, used when no
+                prebuilt index source is configured
+            
+        Returns:
+            Opened reference index
+        """
+        if self.reference_index is None:
+            self.reference_index = ensure_index(
+                self.reference_index_path,
+                source=self.reference_index_source or None,
+                builder=builder
+            )
+            logger.info(f"Reference index opened with {len(self.reference_index)} keys")
+        return self.reference_index
+    
     def process_data(self):
         """
         Main data processing logic.
@@ -129,15 +216,35 @@ class BatchJob:
             # Example: Download input data from S3
             if self.input_path:
                 logger.info(f"Downloading input from: {self.input_path}")
-                # data = download_from_s3(self.input_path)
+                # data = download_from_s3(self.input_path, codec=self.input_codec)
+                
+                # Parquet input: fetch only the needed columns and row groups
+                # (imported here so jobs without Parquet input skip pyarrow)
+                # from parquet_reader import read_parquet
+                # table = read_parquet(
+                #     self.input_path,
+                #     columns=['customer_id', 'amount'],
+                #     filters=[('event_date', '>=', date(2025, 1, 1))]
+                # )
                 # logger.info(f"Downloaded {len(data)} bytes")
             
             # Example: Process data
             logger.info(f"Processing in {self.processing_mode} mode")
             
+            # Example: Buffer intermediate results, spilling under pressure
+            # with SpillBuffer(self.memory_governor, self.scratch_dir) as buffer:
+            #     for record in records:
+            #         buffer.append(transform(record))
+            #     for result in buffer:
+            #         ...
+            
             # Simulate processing
             import time
             for i in range(10):
+                # Size each batch to the current memory headroom
+                batch_size = self.memory_governor.scale(self.batch_size)
+                logger.debug(f"Batch {i} size {batch_size}")
+                
                 # Your processing logic here
                 time.sleep(1)
                 self.metrics['records_processed'] += 1
@@ -149,6 +256,27 @@ class BatchJob:
                         extra={'progress': (i + 1) / 10}
                     )
             
+            # Example: Enrich records from the shared reference index
+            # reference = self.open_reference_index()
+            # customer = reference.get(record['customer_id'], decode=json.loads)
+            
+            # Example: Aggregate by key within a fixed memory budget
+            # with ExternalGroupBy(
+            #     key=lambda r: r['customer_id'],
+            #     value=lambda r: r['amount'],
+            #     combiner=operator.add,
+            #     scratch_dir=self.scratch_dir,
+            #     governor=self.memory_governor
+            # ) as totals:
+            #     totals.extend(records)
+            #     for customer_id, amount in totals.groups():
+            #         ...
+            
+            # Example: Stream many small results to a prefix as large objects
+            # with self.open_output_sink() as sink:
+            #     for result in results:
+            #         sink.write(result)
+            
             # Example: Upload results to S3
             if self.output_path:
                 logger.info(f"Uploading results to: {self.output_path}")
@@ -158,7 +286,12 @@ class BatchJob:
                     'records_processed': self.metrics['records_processed'],
                     'status': 'completed'
                 }
-                # upload_to_s3(self.output_path, json.dumps(result_data))
+                # upload_to_s3(
+                #     self.output_path,
+                #     json.dumps(result_data),
+                #     codec=self.output_codec,
+                #     compression_level=self.compression_level
+                # )
                 logger.info("Results uploaded successfully")
             
             # Calculate processing time
@@ -197,6 +330,73 @@ class BatchJob:
                 namespace=f'{self.project_name}/BatchJobs'
             )
             
+            # Per-codec compression ratio and throughput
+            for codec, stats in codec_stats().items():
+                dimensions = {'Codec': codec}
+                put_metric(
+                    'CompressionRatio',
+                    stats['ratio'],
+                    unit='None',
+                    namespace=f'{self.project_name}/BatchJobs',
+                    dimensions=dimensions
+                )
+                put_metric(
+                    'CompressionThroughput',
+                    stats['throughput_mbps'],
+                    unit='Megabytes/Second',
+                    namespace=f'{self.project_name}/BatchJobs',
+                    dimensions=dimensions
+                )
+            
+            # Coalesced output objects
+            if self.output_sink is not None:
+                put_metric(
+                    'OutputObjectsWritten',
+                    self.output_sink.metrics['objects_written'],
+                    unit='Count',
+                    namespace=f'{self.project_name}/BatchJobs'
+                )
+            
+            # Memory pressure and spill volume
+            memory = self.memory_governor.snapshot()
+            put_metric(
+                'PeakMemoryUtilization',
+                memory['peak_rss_bytes'] / memory['memory_limit_bytes'] * 100
+                if memory['memory_limit_bytes'] else 0,
+                unit='Percent',
+                namespace=f'{self.project_name}/BatchJobs'
+            )
+            put_metric(
+                'MemoryPressureEvents',
+                memory['pressure_events'],
+                unit='Count',
+                namespace=f'{self.project_name}/BatchJobs'
+            )
+            put_metric(
+                'SpillBytes',
+                memory['spill_bytes'],
+                unit='Bytes',
+                namespace=f'{self.project_name}/BatchJobs'
+            )
+            
+            # Adaptive S3 concurrency per bucket/prefix
+            for prefix, stats in get_controller().metrics().items():
+                dimensions = {'Prefix': prefix}
+                put_metric(
+                    'S3ConcurrencyLimit',
+                    stats['limit'],
+                    unit='Count',
+                    namespace=f'{self.project_name}/BatchJobs',
+                    dimensions=dimensions
+                )
+                put_metric(
+                    'S3Throttles',
+                    stats['throttles'],
+                    unit='Count',
+                    namespace=f'{self.project_name}/BatchJobs',
+                    dimensions=dimensions
+                )
+            
             logger.info("Metrics published successfully")
             
         except Exception as e:
@@ -207,6 +407,10 @@ class BatchJob:
         """Cleanup resources."""
         logger.info("Cleaning up resources")
         # Add cleanup logic here (temp files, connections, etc.)
+        
+        if self.reference_index is not None:
+            self.reference_index.close()
+            self.reference_index = None
     
     def run(self) -> int:
         """
@@ -226,21 +430,27 @@ class BatchJob:
             )
             
             # Validate configuration
-            if not self.validate_configuration():
+            with self.profiler.phase('validate_configuration'):
+                valid = self.validate_configuration()
+            if not valid:
                 logger.error("Configuration validation failed")
                 return 1
             
             # Load secrets (if needed)
-            # self.load_secrets()
+            # with self.profiler.phase('load_secrets'):
+            #     self.load_secrets()
             
             # Process data
-            self.process_data()
+            with self.profiler.phase('process_data'):
+                self.process_data()
             
             # Publish metrics
-            self.publish_metrics()
+            with self.profiler.phase('publish_metrics'):
+                self.publish_metrics()
             
             # Cleanup
-            self.cleanup()
+            with self.profiler.phase('cleanup'):
+                self.cleanup()
             
             logger.info(
                 "Batch job completed successfully",
@@ -263,6 +473,10 @@ class BatchJob:
                 }
             )
             return 1
+        
+        finally:
+            # Reports are written even when the job fails
+            self.profiler.finish()
 
 
 def main():
@@ -0,0 +1,333 @@
+"""
+External merge sort and group-by for datasets larger than memory.
+
+Records are serialized on arrival and held in memory up to a fixed byte
+budget. When the budget is reached the buffer is sorted by key and written
+to local scratch as a run of (pickled key, pickled record) frames; at the
+end all runs are k-way merged with a heap, decoding only the keys. Group-by can fold values with a combiner
+while they are still in memory, so aggregates spill far less than the raw
+records would.
+"""
+
+import heapq
+import logging
+import os
+import pickle
+import tempfile
+import time
+from itertools import chain
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+from memory_governor import read_spill_file, write_spill_file
+
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+# Runs merged at once; more runs are merged in several passes
+DEFAULT_MAX_FAN_IN = 64
+
+# Approximate per-entry bookkeeping cost of the in-memory buffer
+ENTRY_OVERHEAD = 120
+
+# (key, pickled key, pickled record); keys are decoded once per read
+Entry = Tuple[Any, bytes, bytes]
+
+
+def _identity(value: Any) -> Any:
+    return value
+
+
+class ExternalSorter:
+    """Sort records by key within a fixed memory budget."""
+
+    def __init__(self, key: Callable[[Any], Any] = None, memory_budget: int = None,
+                 scratch_dir: str = None, governor=None,
+                 max_fan_in: int = DEFAULT_MAX_FAN_IN):
+        """
+        Initialize the sorter.
+
+        Args:
+            key: Function returning the sort key of a record (the record
+                itself by default); keys must be orderable and picklable
+            memory_budget: Bytes of serialized records held before spilling
+                (defaults to SORT_MEMORY_MB or 256 MB)
+            scratch_dir: Directory for runs (defaults to SCRATCH_DIR or the
+                system temp directory)
+            governor: Optional MemoryGovernor; spill early under pressure
+            max_fan_in: Maximum runs merged in one pass
+        """
+        if memory_budget is None:
+            memory_budget = int(os.getenv('SORT_MEMORY_MB', '0')) * 1024 * 1024 or DEFAULT_MEMORY_BUDGET
+
+        self.key = key or _identity
+        self.memory_budget = memory_budget
+        self.scratch_dir = scratch_dir or os.getenv('SCRATCH_DIR', tempfile.gettempdir())
+        self.governor = governor
+        self.max_fan_in = max(2, max_fan_in)
+
+        self.buffer: List[Entry] = []
+        self.buffered_bytes = 0
+        self.runs: List[str] = []
+
+        self.metrics = {
+            'records': 0,
+            'runs': 0,
+            'spill_bytes': 0,
+            'merge_passes': 0,
+            'merge_rewrite_bytes': 0,
+            'merge_seconds': 0.0,
+            'merge_records_per_second': 0.0,
+        }
+
+    def add(self, record: Any):
+        """Add one record."""
+        self._buffer(self.key(record), record)
+        self.metrics['records'] += 1
+        self._maybe_spill()
+
+    def _buffer(self, key: Any, value: Any):
+        key_bytes = pickle.dumps(key, protocol=pickle.HIGHEST_PROTOCOL)
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self.buffer.append((key, key_bytes, payload))
+        self.buffered_bytes += len(key_bytes) + len(payload) + ENTRY_OVERHEAD
+
+    def extend(self, records: Iterable[Any]):
+        """Add many records."""
+        for record in records:
+            self.add(record)
+
+    def _maybe_spill(self):
+        if self.buffered_bytes >= self.memory_budget:
+            self.spill()
+        elif (self.governor is not None and self.metrics['records'] % 10000 == 0
+                and self.governor.should_spill()):
+            self.spill()
+
+    def _sorted_frames(self) -> Iterator[Tuple[bytes, bytes]]:
+        self.buffer.sort(key=itemgetter(0))
+        return ((key_bytes, payload) for _, key_bytes, payload in self.buffer)
+
+    def spill(self):
+        """Sort the in-memory buffer and write it to scratch as a run."""
+        if not self.buffer:
+            return
+        path, written = self._write_run(self._sorted_frames())
+        self.buffer = []
+        self._record_run(path, written)
+
+    def _record_run(self, path: str, written: int):
+        """Account for a run spilled from memory (not a merge-pass rewrite)."""
+        self.runs.append(path)
+        self.buffered_bytes = 0
+        self.metrics['runs'] += 1
+        self.metrics['spill_bytes'] += written
+        if self.governor is not None:
+            self.governor.record_spill(written)
+
+        logging.debug(f"Spilled run {len(self.runs)} ({written} bytes) to {path}")
+
+    def _write_run(self, frames: Iterable[Tuple[bytes, bytes]]) -> Tuple[str, int]:
+        return write_spill_file(self.scratch_dir, 'run-', chain.from_iterable(frames))
+
+    @staticmethod
+    def _read_run(path: str) -> Iterator[Entry]:
+        """Yield entries from a run file, unpickling only the keys."""
+        frames = read_spill_file(path)
+        for key_bytes in frames:
+            yield pickle.loads(key_bytes), key_bytes, next(frames)
+
+    @staticmethod
+    def _heap_merge(sources: List[Iterator[Entry]]) -> Iterator[Entry]:
+        """K-way merge of sorted entry streams, stable across sources."""
+        heap = []
+        for index, source in enumerate(sources):
+            for key, key_bytes, payload in source:
+                heap.append((key, index, key_bytes, payload))
+                break
+        heapq.heapify(heap)
+
+        while heap:
+            key, index, key_bytes, payload = heap[0]
+            yield key, key_bytes, payload
+            for next_key, next_key_bytes, next_payload in sources[index]:
+                heapq.heapreplace(heap, (next_key, index, next_key_bytes, next_payload))
+                break
+            else:
+                heapq.heappop(heap)
+
+    def _merged(self) -> Iterator[Entry]:
+        """Return one sorted stream over all runs and the in-memory buffer."""
+        if not self.runs:
+            self.buffer.sort(key=itemgetter(0))
+            return iter(self.buffer)
+
+        # Keep the final merge within the fan-in by spilling the buffer
+        # as one more run, then merging runs in passes
+        self.spill()
+        while len(self.runs) > self.max_fan_in:
+            self.metrics['merge_passes'] += 1
+            groups = [self.runs[i:i + self.max_fan_in] for i in range(0, len(self.runs), self.max_fan_in)]
+            merged_runs = []
+            for group in groups:
+                if len(group) == 1:
+                    merged_runs.extend(group)
+                    continue
+                stream = self._heap_merge([self._read_run(path) for path in group])
+                path, written = self._write_run((key_bytes, payload) for _, key_bytes, payload in stream)
+                self.metrics['merge_rewrite_bytes'] += written
+                self._remove(group)
+                merged_runs.append(path)
+            self.runs = merged_runs
+
+        self.metrics['merge_passes'] += 1
+        return self._heap_merge([self._read_run(path) for path in self.runs])
+
+    def _timed(self, stream: Iterator[Entry]) -> Iterator[Entry]:
+        start = time.perf_counter()
+        count = 0
+        for item in stream:
+            count += 1
+            yield item
+        seconds = time.perf_counter() - start
+        self.metrics['merge_seconds'] = seconds
+        self.metrics['merge_records_per_second'] = count / seconds if seconds else 0.0
+        logging.info(
+            f"Merged {count} records from {self.metrics['runs']} runs "
+            f"({self.metrics['spill_bytes']} bytes spilled) at "
+            f"{self.metrics['merge_records_per_second']:.0f} records/s"
+        )
+
+    def __iter__(self) -> Iterator[Any]:
+        """Yield all records in key order."""
+        for _, _, payload in self._timed(self._merged()):
+            yield pickle.loads(payload)
+
+    def _remove(self, paths: List[str]):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def close(self):
+        """Delete runs and drop buffered records."""
+        self._remove(self.runs)
+        self.runs = []
+        self.buffer = []
+        self.buffered_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ExternalGroupBy(ExternalSorter):
+    """
+    Group records by key within a fixed memory budget.
+
+    With a combiner, values are folded per key in memory (hash aggregation)
+    and again while merging, so each key costs one aggregate. Without one,
+    each group's values are collected into a list during the merge, which
+    must fit in memory for the largest group.
+    """
+
+    def __init__(self, key: Callable[[Any], Any], value: Callable[[Any], Any] = None,
+                 combiner: Callable[[Any, Any], Any] = None, **kwargs):
+        """
+        Initialize the group-by.
+
+        Args:
+            key: Function returning the group key of a record
+            value: Function returning the value to aggregate (the record
+                itself by default)
+            combiner: Associative function folding two values into one,
+                e.g. operator.add
+            **kwargs: ExternalSorter arguments
+        """
+        super().__init__(key=key, **kwargs)
+        self.value = value or _identity
+        self.combiner = combiner
+        self.aggregates: Dict[Any, Any] = {}
+
+    def add(self, record: Any):
+        """Add one record."""
+        key = self.key(record)
+        value = self.value(record)
+
+        if self.combiner is None:
+            self._buffer(key, value)
+        else:
+            if key in self.aggregates:
+                self.aggregates[key] = self.combiner(self.aggregates[key], value)
+            else:
+                self.aggregates[key] = value
+                # Size is estimated when a key first appears; aggregates
+                # are assumed not to grow much after that
+                self.buffered_bytes += len(pickle.dumps((key, value))) + ENTRY_OVERHEAD
+
+        self.metrics['records'] += 1
+        self._maybe_spill()
+
+    def _sorted_frames(self) -> Iterator[Tuple[bytes, bytes]]:
+        if self.combiner is None:
+            return super()._sorted_frames()
+        items = sorted(self.aggregates.items(), key=itemgetter(0))
+        self.aggregates = {}
+        return (
+            (pickle.dumps(key, protocol=pickle.HIGHEST_PROTOCOL),
+             pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+            for key, value in items
+        )
+
+    def spill(self):
+        """Sort buffered values or aggregates and write them as a run."""
+        if self.combiner is not None and self.aggregates:
+            self._record_run(*self._write_run(self._sorted_frames()))
+            return
+        super().spill()
+
+    def _merged(self) -> Iterator[Entry]:
+        if self.combiner is not None and not self.runs:
+            items = sorted(self.aggregates.items(), key=itemgetter(0))
+            return ((key, b'', pickle.dumps(value)) for key, value in items)
+        return super()._merged()
+
+    def groups(self) -> Iterator[Tuple[Any, Any]]:
+        """
+        Yield (key, aggregate) pairs in key order.
+
+        The aggregate is the combined value with a combiner, otherwise the
+        list of values in the group.
+        """
+        current_key = None
+        current = None
+        started = False
+
+        for key, _, payload in self._timed(self._merged()):
+            value = pickle.loads(payload)
+            if started and key == current_key:
+                if self.combiner is None:
+                    current.append(value)
+                else:
+                    current = self.combiner(current, value)
+                continue
+
+            if started:
+                yield current_key, current
+            current_key = key
+            current = [value] if self.combiner is None else value
+            started = True
+
+        if started:
+            yield current_key, current
+
+    def __iter__(self) -> Iterator[Tuple[Any, Any]]:
+        return self.groups()
+
+    def close(self):
+        """Delete runs and drop buffered state."""
+        super().close()
+        self.aggregates = {}
@@ -0,0 +1,366 @@
+"""
+On-demand profiling for batch job runs.
+
+Enabled by environment variable so a production image can be profiled
+without rebuilding:
+
+    PROFILE_MODE          cprofile, sampling, tracemalloc (comma-separated)
+    PROFILE_SAMPLE_RATE   Fraction of runs to profile (default 1.0)
+    PROFILE_MAX_SECONDS   Stop collecting after this many seconds (default 300)
+    PROFILE_MAX_OVERHEAD  Sampler CPU budget as a fraction of wall time (default 0.02)
+    PROFILE_INTERVAL      Sampling interval in seconds (default 0.01)
+    PROFILE_DIR           Local directory for reports (default: temp dir)
+    PROFILE_UPLOAD        Upload reports next to OUTPUT_PATH (default false)
+
+Reports are written per phase: ``<phase>.pstats`` and ``<phase>.txt`` for
+cProfile, ``<phase>.alloc.txt`` for tracemalloc, and one
+``samples.collapsed`` file (flame graph input) for the sampler.
+"""
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from utils import upload_to_s3
+
+
+MODES = {'cprofile', 'sampling', 'tracemalloc'}
+
+# Rows in text reports
+TOP_N = 40
+
+# cProfile hooks every thread through sys.monitoring from Python 3.12, so
+# another thread can disable it; before that only the profiled thread can
+CPROFILE_STOPS_CROSS_THREAD = sys.version_info >= (3, 12)
+
+
+class StackSampler:
+    """Low-overhead wall-clock sampler producing collapsed stacks."""
+
+    def __init__(self, interval: float = 0.01, max_overhead: float = 0.02,
+                 deadline: float = None):
+        """
+        Initialize the sampler.
+
+        Args:
+            interval: Seconds between samples
+            max_overhead: Sampler CPU time allowed as a fraction of wall
+                time; the interval is stretched to stay under it
+            deadline: Monotonic time after which sampling stops
+        """
+        self.interval = interval
+        self.max_overhead = max_overhead
+        self.deadline = deadline
+        self.phase = 'run'
+        self.started = time.monotonic()
+
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.sampler_seconds = 0.0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._loop, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self.started = time.monotonic()
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def _loop(self):
+        own_id = threading.get_ident()
+        names = {}
+
+        while not self.stop_event.wait(self.interval):
+            if self.deadline and time.monotonic() >= self.deadline:
+                logging.info("Sampling profiler reached its time cap")
+                return
+
+            begin = time.thread_time()
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                stack.append(self.phase)
+                self.stacks[';'.join(reversed(stack))] += 1
+
+            self.samples += 1
+            self.sampler_seconds += time.thread_time() - begin
+
+            # Back off when the sampler costs more than its budget
+            elapsed = time.monotonic() - self.started
+            if self.sampler_seconds > self.max_overhead * elapsed:
+                self.interval = min(self.interval * 2, 1.0)
+
+    def collapsed(self) -> str:
+        """Return samples in collapsed-stack format (one 'stack count' per line)."""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class Profiler:
+    """Per-phase profiler for BatchJob runs; a no-op when disabled."""
+
+    def __init__(self, modes: List[str] = None, job_id: str = 'local-job',
+                 output_path: str = '', report_dir: str = None,
+                 max_seconds: float = 300.0, max_overhead: float = 0.02,
+                 interval: float = 0.01, upload: bool = False):
+        """
+        Initialize the profiler.
+
+        Args:
+            modes: Profiling modes to enable (empty disables profiling)
+            job_id: Job ID used to name the report directory
+            output_path: Job OUTPUT_PATH; reports upload next to it
+            report_dir: Local directory for reports
+            max_seconds: Collection time cap; the sampler and tracemalloc
+                stop as soon as it passes, as does cProfile on Python
+                3.12+ (before 3.12 cProfile runs to the end of a phase
+                that started within the cap)
+            max_overhead: Sampler CPU budget as a fraction of wall time
+            interval: Sampling interval in seconds
+            upload: Upload reports to S3 on finish
+        """
+        self.modes = set(modes or [])
+        unknown = self.modes - MODES
+        if unknown:
+            raise ValueError(f"Unknown profile modes: {', '.join(sorted(unknown))}")
+
+        self.enabled = bool(self.modes)
+        self.job_id = job_id
+        self.output_path = output_path
+        self.max_seconds = max_seconds
+        self.upload = upload
+        self.reports: List[str] = []
+        self.phase_times: Dict[str, float] = {}
+
+        self.started = time.monotonic()
+        self.deadline = self.started + max_seconds
+        self.sampler = None
+
+        if not self.enabled:
+            return
+
+        safe_id = job_id.replace(':', '-')
+        self.report_dir = os.path.join(report_dir or tempfile.gettempdir(), f"profile-{safe_id}")
+        os.makedirs(self.report_dir, exist_ok=True)
+
+        if 'sampling' in self.modes:
+            self.sampler = StackSampler(interval, max_overhead, self.deadline)
+            self.sampler.start()
+
+        if 'tracemalloc' in self.modes and not tracemalloc.is_tracing():
+            tracemalloc.start(int(os.getenv('PROFILE_TRACEMALLOC_FRAMES', '10')))
+
+        logging.info(f"Profiling enabled ({', '.join(sorted(self.modes))}), reports in {self.report_dir}")
+
+    @classmethod
+    def from_env(cls, job_id: str, output_path: str = '') -> 'Profiler':
+        """
+        Build a profiler from PROFILE_* environment variables.
+
+        Args:
+            job_id: Job ID used to name reports
+            output_path: Job OUTPUT_PATH
+
+        Returns:
+            Profiler (disabled unless PROFILE_MODE is set and this run
+            falls within PROFILE_SAMPLE_RATE, or if the settings are
+            invalid)
+        """
+        modes = [m.strip() for m in os.getenv('PROFILE_MODE', '').split(',') if m.strip()]
+        if not modes:
+            return cls(job_id=job_id, output_path=output_path)
+
+        # Profiling must never fail the job: bad settings disable it
+        try:
+            if random.random() >= float(os.getenv('PROFILE_SAMPLE_RATE', '1.0')):
+                return cls(job_id=job_id, output_path=output_path)
+
+            return cls(
+                modes=modes,
+                job_id=job_id,
+                output_path=output_path,
+                report_dir=os.getenv('PROFILE_DIR'),
+                max_seconds=float(os.getenv('PROFILE_MAX_SECONDS', '300')),
+                max_overhead=float(os.getenv('PROFILE_MAX_OVERHEAD', '0.02')),
+                interval=float(os.getenv('PROFILE_INTERVAL', '0.01')),
+                upload=os.getenv('PROFILE_UPLOAD', 'false').lower() == 'true'
+            )
+        except (ValueError, OSError) as e:
+            logging.warning(f"Profiling disabled, invalid PROFILE_* settings: {e}")
+            return cls(job_id=job_id, output_path=output_path)
+
+    def _within_budget(self) -> bool:
+        return time.monotonic() < self.deadline
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Profile one phase of the run.
+
+        Args:
+            name: Phase name used in report file names
+        """
+        if not self.enabled:
+            yield
+            return
+
+        profile = None
+        if 'cprofile' in self.modes and self._within_budget():
+            profile = cProfile.Profile()
+
+        before = None
+        if 'tracemalloc' in self.modes and tracemalloc.is_tracing():
+            before = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+
+        if self.sampler:
+            self.sampler.phase = name
+
+        # Enforce the time cap mid-phase: a phase such as process_data can
+        # be the whole run
+        capped = {}
+
+        def enforce_cap():
+            if before is not None and tracemalloc.is_tracing():
+                capped['after'] = tracemalloc.take_snapshot()
+                capped['memory'] = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                logging.info("tracemalloc reached its time cap")
+            if profile and CPROFILE_STOPS_CROSS_THREAD:
+                profile.disable()
+                logging.info("cProfile reached its time cap")
+
+        timer = None
+        if profile or before is not None:
+            timer = threading.Timer(max(0.0, self.deadline - time.monotonic()), enforce_cap)
+            timer.daemon = True
+            timer.start()
+
+        start = time.perf_counter()
+        if profile:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+            self.phase_times[name] = time.perf_counter() - start
+            if timer:
+                timer.cancel()
+                timer.join()
+
+            # Profiling must never fail the job or mask its exception
+            try:
+                if profile:
+                    self._write_cprofile(name, profile)
+                if before is not None:
+                    if 'after' in capped:
+                        self._write_allocations(name, before, capped['after'], *capped['memory'])
+                    elif tracemalloc.is_tracing():
+                        self._write_allocations(name, before, tracemalloc.take_snapshot(),
+                                                *tracemalloc.get_traced_memory())
+            except Exception as e:
+                logging.warning(f"Error writing profile reports for phase {name}: {e}")
+
+            if 'tracemalloc' in self.modes and not self._within_budget() and tracemalloc.is_tracing():
+                logging.info("tracemalloc reached its time cap")
+                tracemalloc.stop()
+
+    def _write_cprofile(self, name: str, profile: cProfile.Profile):
+        stats_path = os.path.join(self.report_dir, f"{name}.pstats")
+        profile.dump_stats(stats_path)
+
+        text = io.StringIO()
+        pstats.Stats(profile, stream=text).sort_stats('cumulative').print_stats(TOP_N)
+        text_path = os.path.join(self.report_dir, f"{name}.txt")
+        with open(text_path, 'w') as f:
+            f.write(text.getvalue())
+
+        self.reports.extend([stats_path, text_path])
+
+    def _write_allocations(self, name: str, before: tracemalloc.Snapshot,
+                           after: tracemalloc.Snapshot, current: int, peak: int):
+        lines = [
+            f"Phase: {name}",
+            f"Traced memory: current {current} bytes, phase peak {peak} bytes",
+            "",
+            f"Top {TOP_N} allocation sites (net growth during phase):",
+        ]
+        for stat in after.compare_to(before, 'lineno')[:TOP_N]:
+            lines.append(str(stat))
+
+        lines.extend(["", f"Top {TOP_N} allocation sites (live at end of phase):"])
+        for stat in after.statistics('lineno')[:TOP_N]:
+            lines.append(str(stat))
+
+        path = os.path.join(self.report_dir, f"{name}.alloc.txt")
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        self.reports.append(path)
+
+    def _upload_prefix(self) -> Optional[str]:
+        if not self.output_path:
+            return None
+        base = self.output_path if self.output_path.endswith('/') else self.output_path.rsplit('/', 1)[0] + '/'
+        return f"{base}_profiles/{self.job_id.replace(':', '-')}/"
+
+    def finish(self) -> List[str]:
+        """
+        Stop collection, write remaining reports and upload them if enabled.
+
+        Returns:
+            Local paths of all reports
+        """
+        if not self.enabled:
+            return []
+
+        if self.sampler:
+            self.sampler.stop()
+            path = os.path.join(self.report_dir, 'samples.collapsed')
+            try:
+                with open(path, 'w') as f:
+                    f.write(self.sampler.collapsed())
+                self.reports.append(path)
+            except OSError as e:
+                logging.warning(f"Error writing profile report {path}: {e}")
+            logging.info(
+                f"Sampler took {self.sampler.samples} samples, "
+                f"{self.sampler.sampler_seconds:.2f}s CPU"
+            )
+
+        if 'tracemalloc' in self.modes and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+        logging.info(f"Profile phase times: {self.phase_times}")
+
+        prefix = self._upload_prefix()
+        if self.upload and prefix:
+            for path in self.reports:
+                try:
+                    upload_to_s3(prefix + os.path.basename(path), path)
+                except Exception as e:
+                    # Profiling must never fail the job
+                    logging.warning(f"Error uploading profile report {path}: {e}")
+
+        return self.reports
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Local Array Job Runner
+
+Emulate an AWS Batch array job on one machine: launch N BatchJob instances
+as separate processes, at most --parallelism at a time, each with its own AWS_BATCH_JOB_ARRAY_INDEX and
+AWS_BATCH_JOB_ID plus the environment from a job-definition JSON, and
+collect exit codes, timings and metrics into one summary.
+
+Usage:
+    python local_runner.py ../job-definitions/array-job.json --size 10 --parallelism 4
+    python local_runner.py ../job-definitions/array-job.json --sweep 1,2,4,8
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import statistics
+import sys
+import time
+import uuid
+from multiprocessing.connection import wait
+from typing import Any, Dict, List
+
+
+def load_job_definition(path: str) -> Dict[str, Any]:
+    """
+    Load a job definition and extract its name, environment and array size.
+
+    Args:
+        path: Path to a job-definition JSON file
+
+    Returns:
+        Dictionary with 'name', 'environment' and 'array_size'
+    """
+    with open(path) as f:
+        definition = json.load(f)
+
+    container = definition.get('containerProperties', {})
+    environment = {
+        entry['name']: entry['value']
+        for entry in container.get('environment', [])
+    }
+
+    return {
+        'name': definition.get('jobDefinitionName', 'local-array-job'),
+        'environment': environment,
+        'array_size': int(environment.get('ARRAY_SIZE', 1)),
+    }
+
+
+def run_child(index: int, environment: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Run one array child in the current (fresh) process.
+
+    Args:
+        index: Array index
+        environment: Environment variables for the child
+
+    Returns:
+        Child result with exit code, timing and metrics
+    """
+    os.environ.update(environment)
+    start = time.perf_counter()
+
+    try:
+        # Imported after the environment is set: app configures logging
+        # and clients at import and construction time
+        from app import BatchJob
+        job = BatchJob()
+        exit_code = job.run()
+        metrics = dict(job.metrics)
+        error = None
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 1
+        metrics = {}
+        error = None
+    except Exception as e:
+        exit_code = 1
+        metrics = {}
+        error = f"{type(e).__name__}: {e}"
+
+    return {
+        'index': index,
+        'job_id': environment['AWS_BATCH_JOB_ID'],
+        'exit_code': exit_code,
+        'seconds': time.perf_counter() - start,
+        'metrics': metrics,
+        'error': error,
+    }
+
+
+def _parallelism(value: str) -> int:
+    level = int(value)
+    if level < 1:
+        raise argparse.ArgumentTypeError(f"parallelism must be at least 1, got {level}")
+    return level
+
+
+def _sweep(value: str) -> List[int]:
+    return [_parallelism(level) for level in value.split(',')]
+
+
+def _child_main(index: int, environment: Dict[str, str], connection):
+    connection.send(run_child(index, environment))
+    connection.close()
+
+
+def _exit_reason(exit_code: int) -> str:
+    if exit_code < 0:
+        try:
+            return f"killed by {signal.Signals(-exit_code).name}"
+        except ValueError:
+            return f"killed by signal {-exit_code}"
+    return f"exited with code {exit_code} without a result"
+
+
+def run_array(definition: Dict[str, Any], size: int, parallelism: int,
+              overrides: Dict[str, str] = None) -> Dict[str, Any]:
+    """
+    Run an array job locally and summarize the children.
+
+    Args:
+        definition: Output of load_job_definition
+        size: Number of array children
+        parallelism: Maximum children running at once
+        overrides: Extra environment variables for every child
+
+    Returns:
+        Summary with per-child results, timing statistics and metric totals
+
+    Raises:
+        ValueError: If parallelism is less than 1
+    """
+    if parallelism < 1:
+        raise ValueError(f"parallelism must be at least 1, got {parallelism}")
+
+    parent_id = f"local-{uuid.uuid4().hex[:8]}"
+    base_environment = dict(definition['environment'])
+    base_environment.update(overrides or {})
+    base_environment.update({
+        'AWS_BATCH_JOB_NAME': definition['name'],
+        'AWS_BATCH_JQ_NAME': 'local',
+        'ARRAY_SIZE': str(size),
+    })
+
+    # A spawned process per child gives every child a clean interpreter,
+    # as separate containers would, and lets one child die (OOM kill,
+    # segfault, os._exit) without taking the others down
+    context = multiprocessing.get_context('spawn')
+    results = []
+    start = time.perf_counter()
+
+    waiting = list(range(size))
+    running = {}
+    while waiting or running:
+        while waiting and len(running) < parallelism:
+            index = waiting.pop(0)
+            environment = dict(base_environment)
+            environment['AWS_BATCH_JOB_ARRAY_INDEX'] = str(index)
+            environment['AWS_BATCH_JOB_ID'] = f"{parent_id}:{index}"
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=_child_main, args=(index, environment, sender))
+            process.start()
+            sender.close()
+            running[index] = {
+                'process': process,
+                'receiver': receiver,
+                'job_id': environment['AWS_BATCH_JOB_ID'],
+                'started': time.perf_counter(),
+                'result': None,
+            }
+
+        # Read results as they arrive: a child blocks sending a large
+        # result until the parent reads it, so it cannot exit first
+        ready = wait([child['receiver'] for child in running.values()]
+                     + [child['process'].sentinel for child in running.values()])
+
+        for index, child in list(running.items()):
+            if child['receiver'] in ready and child['result'] is None:
+                try:
+                    child['result'] = child['receiver'].recv()
+                except EOFError:
+                    pass
+            if child['process'].sentinel not in ready and child['result'] is None:
+                continue
+
+            child['process'].join()
+            child['receiver'].close()
+            del running[index]
+
+            result = child['result']
+            if result is None:
+                exit_code = child['process'].exitcode
+                result = {
+                    'index': index,
+                    'job_id': child['job_id'],
+                    'exit_code': exit_code if exit_code else 1,
+                    'seconds': time.perf_counter() - child['started'],
+                    'metrics': {},
+                    'error': _exit_reason(exit_code),
+                }
+
+            status = 'ok' if result['exit_code'] == 0 else f"exit {result['exit_code']}"
+            if result['error']:
+                status += f" ({result['error']})"
+            print(f"[{result['index']}] {status} in {result['seconds']:.2f}s", file=sys.stderr)
+            results.append(result)
+
+    wall_seconds = time.perf_counter() - start
+    results.sort(key=lambda r: r['index'])
+    return summarize(parent_id, results, parallelism, wall_seconds)
+
+
+def summarize(parent_id: str, results: List[Dict[str, Any]], parallelism: int,
+              wall_seconds: float) -> Dict[str, Any]:
+    """Aggregate child results into one summary."""
+    durations = sorted(r['seconds'] for r in results)
+    totals: Dict[str, float] = {}
+    for result in results:
+        for name, value in result['metrics'].items():
+            if isinstance(value, (int, float)):
+                totals[name] = totals.get(name, 0) + value
+
+    busy_seconds = sum(durations)
+    return {
+        'job_id': parent_id,
+        'size': len(results),
+        'parallelism': parallelism,
+        'succeeded': sum(1 for r in results if r['exit_code'] == 0),
+        'failed': sum(1 for r in results if r['exit_code'] != 0),
+        'wall_seconds': wall_seconds,
+        'child_seconds': {
+            'min': durations[0] if durations else 0,
+            'median': statistics.median(durations) if durations else 0,
+            'p95': durations[int(0.95 * (len(durations) - 1))] if durations else 0,
+            'max': durations[-1] if durations else 0,
+            'total': busy_seconds,
+        },
+        # Ideal is `parallelism` (or `size` if smaller)
+        'speedup': busy_seconds / wall_seconds if wall_seconds else 0,
+        'children_per_second': len(results) / wall_seconds if wall_seconds else 0,
+        'metrics': totals,
+        'children': results,
+    }
+
+
+def main():
+    """Main entry point for CLI."""
+    parser = argparse.ArgumentParser(
+        description='Run an AWS Batch array job locally with one process per child'
+    )
+
+    parser.add_argument(
+        'job_definition',
+        help='Path to a job-definition JSON file'
+    )
+
+    parser.add_argument(
+        '--size',
+        type=int,
+        default=None,
+        help='Number of array children (default: ARRAY_SIZE from the definition)'
+    )
+
+    parser.add_argument(
+        '--parallelism',
+        type=_parallelism,
+        default=os.cpu_count() or 1,
+        help='Maximum children running at once (default: CPU count)'
+    )
+
+    parser.add_argument(
+        '--sweep',
+        type=_sweep,
+        default=None,
+        help='Comma-separated parallelism values to compare, e.g. 1,2,4,8'
+    )
+
+    parser.add_argument(
+        '--env',
+        action='append',
+        default=[],
+        metavar='KEY=VALUE',
+        help='Environment override for every child (can be repeated)'
+    )
+
+    parser.add_argument(
+        '--output',
+        default=None,
+        help='Write the JSON summary to this file'
+    )
+
+    args = parser.parse_args()
+
+    definition = load_job_definition(args.job_definition)
+    size = args.size or definition['array_size']
+    overrides = dict(item.split('=', 1) for item in args.env)
+
+    if args.sweep:
+        levels = args.sweep
+    else:
+        levels = [args.parallelism]
+
+    summaries = [run_array(definition, size, level, overrides) for level in levels]
+
+    for summary in summaries:
+        print(
+            f"parallelism={summary['parallelism']:>3}  size={summary['size']}  "
+            f"wall={summary['wall_seconds']:.2f}s  speedup={summary['speedup']:.2f}  "
+            f"succeeded={summary['succeeded']}  failed={summary['failed']}",
+            file=sys.stderr
+        )
+
+    report = summaries[0] if len(summaries) == 1 else {'sweep': summaries}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    sys.exit(1 if any(s['failed'] for s in summaries) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,369 @@
+"""
+Memory-budget governor for batch jobs.
+
+Reads the container memory limit from cgroup, tracks the process RSS
+against it, shrinks batch/chunk sizes as pressure rises and spills buffered
+intermediate data to local scratch past a high-water mark, so a job can use
+the memory it pays for without being OOM-killed.
+"""
+
+import logging
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+CGROUP_V2_LIMIT = '/sys/fs/cgroup/memory.max'
+CGROUP_V1_LIMIT = '/sys/fs/cgroup/memory/memory.limit_in_bytes'
+
+# cgroup v1 reports "unlimited" as a huge page-aligned number
+UNLIMITED_THRESHOLD = 1 << 60
+
+LEVELS = ('normal', 'elevated', 'high', 'critical')
+
+# RSS growth required between spills when no memory limit is known
+DEFAULT_SPILL_MARGIN = 64 * 1024 * 1024
+
+# Bytes appended to a SpillBuffer between memory pressure checks
+SPILL_CHECK_BYTES = 4 * 1024 * 1024
+
+# Length prefix for frames in spill files
+_LENGTH = struct.Struct('<I')
+_SPILL_BUFFER_SIZE = 1024 * 1024
+
+
+def write_spill_file(scratch_dir: str, prefix: str, frames: Iterable[bytes]) -> Tuple[str, int]:
+    """
+    Write byte frames to a new length-prefixed spill file.
+
+    Args:
+        scratch_dir: Directory for the file
+        prefix: File name prefix, e.g. 'spill-'
+        frames: Byte strings to write, in order
+
+    Returns:
+        (path, bytes written); the file is removed if writing fails
+    """
+    fd, path = tempfile.mkstemp(prefix=prefix, suffix='.bin', dir=scratch_dir)
+    written = 0
+    try:
+        with os.fdopen(fd, 'wb', buffering=_SPILL_BUFFER_SIZE) as f:
+            for frame in frames:
+                f.write(_LENGTH.pack(len(frame)))
+                f.write(frame)
+                written += _LENGTH.size + len(frame)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, written
+
+
+def read_spill_file(path: str) -> Iterator[bytes]:
+    """
+    Yield the frames of a spill file written by write_spill_file.
+
+    Args:
+        path: Spill file path
+
+    Yields:
+        Byte frames, in order
+    """
+    with open(path, 'rb', buffering=_SPILL_BUFFER_SIZE) as f:
+        while True:
+            header = f.read(_LENGTH.size)
+            if not header:
+                return
+            (length,) = _LENGTH.unpack(header)
+            yield f.read(length)
+
+
+def read_memory_limit() -> Optional[int]:
+    """
+    Read the container memory limit.
+
+    Checks cgroup v2, then cgroup v1, then the MEMORY_LIMIT_MB environment
+    variable, and finally falls back to physical memory.
+
+    Returns:
+        Memory limit in bytes, or None if it cannot be determined
+    """
+    for path in (CGROUP_V2_LIMIT, CGROUP_V1_LIMIT):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value != 'max' and int(value) < UNLIMITED_THRESHOLD:
+            return int(value)
+
+    configured = os.getenv('MEMORY_LIMIT_MB')
+    if configured:
+        return int(configured) * 1024 * 1024
+
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def read_rss() -> int:
+    """
+    Return the resident set size of the current process in bytes.
+
+    Returns:
+        RSS in bytes (0 if it cannot be read)
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+
+    try:
+        import resource
+        # Peak RSS is the best portable approximation (KiB on Linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        return 0
+
+
+class MemoryGovernor:
+    """Track memory pressure against the container limit and react to it."""
+
+    def __init__(self, limit_bytes: int = None, low_water: float = 0.60,
+                 high_water: float = 0.80, critical: float = 0.90,
+                 check_interval: float = 0.25):
+        """
+        Initialize the governor.
+
+        Args:
+            limit_bytes: Memory limit (defaults to the cgroup limit)
+            low_water: Utilization below which sizes are not reduced
+            high_water: Utilization at which buffered data is spilled
+            critical: Utilization at which sizes drop to their minimum
+            check_interval: Minimum seconds between RSS reads
+        """
+        self.limit_bytes = limit_bytes or read_memory_limit()
+        self.low_water = low_water
+        self.high_water = high_water
+        self.critical = critical
+        self.check_interval = check_interval
+
+        self.lock = threading.Lock()
+        self.last_check = 0.0
+        self.rss = 0
+        self.level = 'normal'
+
+        # Freed memory is rarely returned to the OS, so RSS stays high after
+        # a spill; require it to grow by half the high-water-to-critical
+        # band past the post-spill level before spilling again
+        if self.limit_bytes:
+            self.spill_margin = int(self.limit_bytes * (critical - high_water) / 2)
+        else:
+            self.spill_margin = DEFAULT_SPILL_MARGIN
+        self.spill_rss = 0
+
+        self.metrics = {
+            'memory_limit_bytes': self.limit_bytes or 0,
+            'peak_rss_bytes': 0,
+            'pressure_events': 0,
+            'spill_bytes': 0,
+            'spill_files': 0,
+        }
+
+        logging.info(f"Memory governor limit: {self.limit_bytes} bytes")
+
+    def pressure(self) -> float:
+        """
+        Return current memory utilization as a fraction of the limit.
+
+        RSS is re-read at most once per check_interval.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now - self.last_check >= self.check_interval:
+                self.last_check = now
+                self.rss = read_rss()
+                self.metrics['peak_rss_bytes'] = max(self.metrics['peak_rss_bytes'], self.rss)
+                self._update_level()
+
+            if not self.limit_bytes:
+                return 0.0
+            return self.rss / self.limit_bytes
+
+    def _update_level(self):
+        utilization = self.rss / self.limit_bytes if self.limit_bytes else 0.0
+        if utilization >= self.critical:
+            level = 'critical'
+        elif utilization >= self.high_water:
+            level = 'high'
+        elif utilization >= self.low_water:
+            level = 'elevated'
+        else:
+            level = 'normal'
+
+        if level != self.level:
+            # Count escalations only, not recoveries
+            if LEVELS.index(level) > LEVELS.index(self.level):
+                self.metrics['pressure_events'] += 1
+            logging.info(
+                f"Memory pressure {self.level} -> {level} "
+                f"({self.rss} of {self.limit_bytes} bytes, {utilization:.0%})"
+            )
+            self.level = level
+
+        if LEVELS.index(self.level) < LEVELS.index('high'):
+            self.spill_rss = 0
+
+    def scale(self, size: int, minimum: int = 1) -> int:
+        """
+        Scale a batch or chunk size down as memory pressure grows.
+
+        Full size below the low-water mark, linearly down to the minimum
+        at the critical mark.
+
+        Args:
+            size: Preferred size with no memory pressure
+            minimum: Smallest size to return
+
+        Returns:
+            Size to use for the next batch
+        """
+        pressure = self.pressure()
+        if pressure <= self.low_water:
+            return size
+        if pressure >= self.critical:
+            return minimum
+
+        fraction = (self.critical - pressure) / (self.critical - self.low_water)
+        return max(minimum, int(size * fraction))
+
+    def should_spill(self) -> bool:
+        """
+        Return True when utilization is at or above the high-water mark
+        and RSS has grown by spill_margin since the last spill.
+        """
+        if self.pressure() < self.high_water:
+            return False
+        with self.lock:
+            return self.rss >= self.spill_rss + self.spill_margin
+
+    def record_spill(self, nbytes: int):
+        """
+        Account for bytes spilled to scratch.
+
+        Call after the spilled data has been released: the RSS read here
+        is the baseline the next spill is measured against.
+        """
+        with self.lock:
+            self.metrics['spill_bytes'] += nbytes
+            self.metrics['spill_files'] += 1
+        self.rebase()
+
+    def rebase(self):
+        """
+        Take the current RSS as the baseline for the next spill.
+
+        For consumers that relieve memory some other way than spilling to
+        scratch, e.g. by sealing a buffer for upload.
+        """
+        rss = read_rss()
+        with self.lock:
+            self.rss = rss
+            self.spill_rss = rss
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return a copy of the metrics with current utilization."""
+        utilization = self.pressure()
+        with self.lock:
+            metrics = dict(self.metrics)
+        metrics['memory_utilization'] = utilization
+        return metrics
+
+
+class SpillBuffer:
+    """
+    Append-only buffer that moves its contents to scratch under pressure.
+
+    Items must be picklable; they are pickled on append, so memory use is
+    tracked in bytes and spilling writes the payloads as they are.
+    Iteration yields items in insertion order, reading spilled runs back
+    from disk one record at a time.
+    """
+
+    def __init__(self, governor: MemoryGovernor, scratch_dir: str = None,
+                 check_bytes: int = SPILL_CHECK_BYTES):
+        """
+        Initialize the buffer.
+
+        Args:
+            governor: Memory governor deciding when to spill
+            scratch_dir: Directory for spill files (defaults to SCRATCH_DIR
+                or the system temp directory)
+            check_bytes: Bytes appended between memory pressure checks
+        """
+        self.governor = governor
+        self.scratch_dir = scratch_dir or os.getenv('SCRATCH_DIR', tempfile.gettempdir())
+        self.check_bytes = check_bytes
+
+        self.items: List[bytes] = []
+        self.spill_paths: List[str] = []
+        self.count = 0
+        self.unchecked_bytes = 0
+
+    def append(self, item: Any):
+        """Add an item, spilling buffered items first if memory is high."""
+        payload = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+        self.items.append(payload)
+        self.count += 1
+        self.unchecked_bytes += len(payload)
+        if self.unchecked_bytes >= self.check_bytes:
+            self.unchecked_bytes = 0
+            if self.governor.should_spill():
+                self.spill()
+
+    def spill(self):
+        """Write all in-memory items to a new spill file."""
+        if not self.items:
+            return
+
+        path, written = write_spill_file(self.scratch_dir, 'spill-', self.items)
+
+        logging.info(f"Spilled {len(self.items)} items ({written} bytes) to {path}")
+        self.spill_paths.append(path)
+        self.items = []
+        self.governor.record_spill(written)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[Any]:
+        for path in self.spill_paths:
+            for payload in read_spill_file(path):
+                yield pickle.loads(payload)
+        for payload in self.items:
+            yield pickle.loads(payload)
+
+    def close(self):
+        """Drop buffered items and delete spill files."""
+        for path in self.spill_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.spill_paths = []
+        self.items = []
+        self.count = 0
+        self.unchecked_bytes = 0
+
+    def __enter__(self) -> 'SpillBuffer':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
@@ -0,0 +1,327 @@
+"""
+Coalescing output sink for batch job results.
+
+Small results are appended to a rolling buffer that is sealed once it
+reaches a target object size or age. Sealed buffers are uploaded as
+parallel multipart uploads on a background pool while new results keep
+arriving, so a million small results land in S3 as a few hundred
+well-sized objects plus an index.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional
+
+from s3_codecs import (
+    CountingIterator,
+    iter_compressed,
+    iter_source,
+    multipart_upload,
+    record_stats,
+    resolve_codec
+)
+from utils import get_s3_client, parse_s3_path
+
+
+DEFAULT_OBJECT_SIZE = 128 * 1024 * 1024
+DEFAULT_MAX_AGE = 300.0
+
+# In-memory buffers sealed but not yet uploaded, across all uploads
+DEFAULT_MAX_PENDING_BYTES = 256 * 1024 * 1024
+
+INDEX_SUFFIX = '-index.json'
+
+
+class _Buffer:
+    """Rolling buffer backed by memory or a spool file in scratch."""
+
+    def __init__(self, spool_dir: Optional[str]):
+        self.created = time.monotonic()
+        self.records = 0
+        self.size = 0
+        self.path = None
+        if spool_dir:
+            fd, self.path = tempfile.mkstemp(prefix='sink-', suffix='.part', dir=spool_dir)
+            self.file = os.fdopen(fd, 'wb', buffering=1024 * 1024)
+        else:
+            self.data = bytearray()
+
+    def write(self, payload: bytes):
+        if self.path:
+            self.file.write(payload)
+        else:
+            self.data += payload
+        self.size += len(payload)
+
+    def seal(self) -> Any:
+        """Return the buffer contents (not copied) or a closed spool file path."""
+        if self.path:
+            self.file.close()
+            return self.path
+        return self.data
+
+
+class CoalescingSink:
+    """Roll many small results into large objects under an S3 prefix."""
+
+    def __init__(self, output_prefix: str, object_size: int = DEFAULT_OBJECT_SIZE,
+                 max_age: float = DEFAULT_MAX_AGE, max_workers: int = 4,
+                 part_workers: int = 4, extension: str = '.jsonl',
+                 codec: str = 'auto', spool_dir: str = None,
+                 name_prefix: str = 'part', governor=None, region: str = None,
+                 max_pending_bytes: int = DEFAULT_MAX_PENDING_BYTES):
+        """
+        Initialize the sink.
+
+        Args:
+            output_prefix: Destination prefix in format s3://bucket/prefix/
+            object_size: Seal a buffer once it holds this many bytes
+            max_age: Seal a buffer once it is this many seconds old
+                (checked on each write and by a background timer)
+            max_workers: Objects uploaded concurrently
+            part_workers: Parts uploaded concurrently within each object
+            extension: Object extension; '.gz'/'.zst' suffixes select a codec
+            codec: Codec name, or 'auto' to pick from the extension
+            spool_dir: Buffer on local scratch instead of in memory
+            name_prefix: Object name prefix (e.g. the job or array index)
+            governor: Optional MemoryGovernor; buffers are sealed early
+                under memory pressure
+            region: AWS region (defaults to AWS_REGION env var)
+            max_pending_bytes: In-memory bytes sealed but not yet uploaded
+                before writers wait (spooled buffers are not counted)
+        """
+        bucket, prefix = parse_s3_path(output_prefix)
+        if prefix and not prefix.endswith('/'):
+            prefix += '/'
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.object_size = object_size
+        self.max_age = max_age
+        self.max_workers = max_workers
+        self.max_pending_bytes = max_pending_bytes
+        self.part_workers = part_workers
+        self.extension = extension
+        self.codec = resolve_codec(extension, codec)
+        self.spool_dir = spool_dir
+        self.name_prefix = name_prefix
+        self.governor = governor
+        self.client = get_s3_client(region)
+
+        # Writers hold `lock` while waiting on uploads, so uploads record
+        # their results under a separate lock
+        self.lock = threading.Lock()
+        self.index_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        # Upload futures mapped to the in-memory bytes they hold
+        self.pending: Dict[Future, int] = {}
+        # Upload failures are kept for flush() rather than raised from an
+        # unrelated write()
+        self.errors: List[BaseException] = []
+        self.index: List[Dict[str, Any]] = []
+        self.sequence = 0
+        self.buffer = None
+        self.closed = False
+
+        self.metrics = {
+            'records_written': 0,
+            'objects_written': 0,
+            'raw_bytes': 0,
+            'stored_bytes': 0,
+        }
+
+        # Seals idle buffers by age; write() only checks when called
+        self.stopping = threading.Event()
+        self.sealer = threading.Thread(target=self._seal_by_age, name='sink-sealer', daemon=True)
+        self.sealer.start()
+
+    def write(self, record: Any):
+        """
+        Append one result.
+
+        Args:
+            record: bytes, str, or a JSON-serializable object; each record
+                is written as one newline-terminated line
+        """
+        if isinstance(record, bytes):
+            payload = record
+        elif isinstance(record, str):
+            payload = record.encode('utf-8')
+        else:
+            payload = json.dumps(record, separators=(',', ':')).encode('utf-8')
+        if not payload.endswith(b'\n'):
+            payload += b'\n'
+
+        with self.lock:
+            if self.closed:
+                raise ValueError("Sink is closed")
+            if self.buffer is None:
+                self.buffer = _Buffer(self.spool_dir)
+
+            self.buffer.write(payload)
+            self.buffer.records += 1
+
+            if self._should_seal():
+                self._seal()
+
+    def _should_seal(self) -> bool:
+        if self.buffer.size >= self.object_size:
+            return True
+        if time.monotonic() - self.buffer.created >= self.max_age:
+            return True
+        if (self.governor is not None and self.spool_dir is None
+                and self.buffer.records % 1000 == 0 and self.governor.should_spill()):
+            # Seal under pressure, then wait for RSS to grow again before
+            # sealing early once more
+            self.governor.rebase()
+            return True
+        return False
+
+    def _seal(self):
+        """Hand the current buffer to the upload pool (caller holds the lock)."""
+        if self.buffer is None or self.buffer.records == 0:
+            return
+
+        # Bound sealed-but-unsent buffers, by count and by in-memory bytes,
+        # so producers cannot outrun uploads
+        held = 0 if self.buffer.path else self.buffer.size
+        while self.pending and (
+                len(self.pending) >= 2 * self.max_workers
+                or sum(self.pending.values()) + held > self.max_pending_bytes):
+            wait(self.pending, return_when=FIRST_COMPLETED)
+            self._collect()
+
+        buffer, self.buffer = self.buffer, None
+        key = f"{self.prefix}{self.name_prefix}-{self.sequence:05d}{self.extension}"
+        self.sequence += 1
+
+        future = self.executor.submit(self._upload, key, buffer.seal(), buffer.records)
+        self.pending[future] = held
+
+    def _collect(self):
+        """Drop finished uploads, keeping their errors (caller holds the lock)."""
+        for future in [f for f in self.pending if f.done()]:
+            del self.pending[future]
+            if future.exception() is not None:
+                self.errors.append(future.exception())
+
+    def _seal_by_age(self):
+        interval = max(1.0, min(self.max_age / 4, 30.0))
+        while not self.stopping.wait(interval):
+            with self.lock:
+                if self.closed:
+                    return
+                if (self.buffer is not None
+                        and time.monotonic() - self.buffer.created >= self.max_age):
+                    self._seal()
+
+    def _stop(self):
+        """Mark the sink closed and stop the age timer before the pool shuts down."""
+        with self.lock:
+            self.closed = True
+        self.stopping.set()
+        self.sealer.join()
+
+    def _upload(self, key: str, data: Any, records: int):
+        start = time.perf_counter()
+        source = CountingIterator(iter_source(data))
+        chunks = iter_compressed(source, self.codec) if self.codec else source
+
+        try:
+            stored = multipart_upload(
+                self.client, self.bucket, key, chunks,
+                max_workers=self.part_workers
+            )
+        finally:
+            if isinstance(data, str):
+                os.remove(data)
+
+        seconds = time.perf_counter() - start
+        if self.codec:
+            record_stats(self.codec, 'upload', source.bytes_seen, stored, seconds)
+
+        entry = {
+            'key': key,
+            'records': records,
+            'raw_bytes': source.bytes_seen,
+            'stored_bytes': stored,
+        }
+        with self.index_lock:
+            self.index.append(entry)
+            self.metrics['records_written'] += records
+            self.metrics['objects_written'] += 1
+            self.metrics['raw_bytes'] += source.bytes_seen
+            self.metrics['stored_bytes'] += stored
+
+        logging.info(f"Uploaded s3://{self.bucket}/{key} ({records} records, {stored} bytes)")
+
+    def flush(self):
+        """
+        Seal the current buffer and wait for all uploads to finish.
+
+        Raises:
+            Exception: The first upload failure since the last flush
+        """
+        with self.lock:
+            self._seal()
+            pending, self.pending = list(self.pending), {}
+            errors, self.errors = self.errors, []
+
+        for future in pending:
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            logging.error(f"{len(errors)} sink uploads failed")
+            raise errors[0]
+
+    def close(self) -> List[Dict[str, Any]]:
+        """
+        Flush remaining results and write the object index.
+
+        Returns:
+            Index entries for every object written, in key order
+        """
+        try:
+            self.flush()
+        finally:
+            self._stop()
+            self.executor.shutdown(wait=True)
+
+        index = sorted(self.index, key=lambda entry: entry['key'])
+        manifest = json.dumps({
+            'objects': index,
+            'records': self.metrics['records_written'],
+            'codec': self.codec,
+        }, indent=2).encode('utf-8')
+
+        index_key = f"{self.prefix}{self.name_prefix}{INDEX_SUFFIX}"
+        multipart_upload(self.client, self.bucket, index_key, [manifest],
+                         ContentType='application/json')
+
+        logging.info(
+            f"Sink wrote {self.metrics['records_written']} records to "
+            f"{self.metrics['objects_written']} objects under s3://{self.bucket}/{self.prefix}"
+        )
+        return index
+
+    def __enter__(self) -> 'CoalescingSink':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Do not publish a partial index for a failed run
+            self._stop()
+            with self.lock:
+                buffer, self.buffer = self.buffer, None
+            if buffer is not None and buffer.path:
+                os.remove(buffer.seal())
+            self.executor.shutdown(wait=True)
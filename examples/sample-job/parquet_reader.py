@@ -0,0 +1,417 @@
+"""
+Parquet reads from S3 that fetch only the bytes a query needs.
+
+The footer is fetched with a suffix-range GET, row groups are pruned
+against a predicate using their min/max statistics, and only the column
+chunks of the surviving row groups are fetched, coalesced into few ranged
+GETs that run in parallel. Bytes transferred scale with the data selected
+rather than with the file size.
+"""
+
+import bisect
+import logging
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet support is optional
+    pa = None
+
+from s3_concurrency import get_controller
+from utils import get_s3_client, parse_s3_path
+
+
+# Initial suffix read; covers the footer of most files in one request
+FOOTER_READ_SIZE = 64 * 1024
+
+# Ranges closer than this are merged into one GET
+DEFAULT_COALESCE_GAP = 1024 * 1024
+
+# Upper bound on a single coalesced GET
+MAX_RANGE_SIZE = 64 * 1024 * 1024
+
+PARQUET_MAGIC = b'PAR1'
+
+# Supported predicate operators, as in pyarrow's filters argument
+OPERATORS = {'==', '=', '!=', '<', '<=', '>', '>=', 'in', 'not in'}
+
+
+def coalesce_ranges(ranges: Sequence[Tuple[int, int]], gap: int = DEFAULT_COALESCE_GAP,
+                    max_size: int = MAX_RANGE_SIZE) -> List[Tuple[int, int]]:
+    """
+    Merge byte ranges that overlap or sit within ``gap`` bytes of each other.
+
+    Args:
+        ranges: (start, end) pairs, end exclusive
+        gap: Largest hole worth reading through to save a request
+        max_size: Largest merged range
+
+    Returns:
+        Sorted, merged (start, end) pairs
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged:
+            last_start, last_end = merged[-1]
+            if start <= last_end + gap and max(end, last_end) - last_start <= max_size:
+                merged[-1] = (last_start, max(end, last_end))
+                continue
+        merged.append((start, end))
+    return merged
+
+
+class S3RangeFile:
+    """
+    Seekable read-only file over an S3 object backed by a range cache.
+
+    Reads are served from prefetched ranges; misses fall back to a ranged
+    GET for exactly the bytes requested.
+    """
+
+    def __init__(self, client, bucket: str, key: str):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.controller = get_controller()
+
+        self.position = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        self.starts: List[int] = []
+        self.blocks: Dict[int, bytes] = {}
+
+        self.bytes_fetched = 0
+        self.requests = 0
+
+        # One suffix-range GET yields both the tail and the object size
+        tail, self.size = self._get('bytes=-%d' % FOOTER_READ_SIZE)
+        self._store(self.size - len(tail), tail)
+
+    def _get(self, byte_range: str) -> Tuple[bytes, int]:
+        def fetch() -> Tuple[bytes, str]:
+            # Read the body inside the request so the concurrency slot
+            # covers the transfer, not just the response headers
+            response = self.client.get_object(Bucket=self.bucket, Key=self.key, Range=byte_range)
+            return response['Body'].read(), response['ContentRange']
+
+        data, content_range = self.controller.call(self.bucket, self.key, fetch)
+        total = int(content_range.rsplit('/', 1)[1])
+        with self.lock:
+            self.bytes_fetched += len(data)
+            self.requests += 1
+        return data, total
+
+    def _store(self, start: int, data: bytes):
+        with self.lock:
+            if start not in self.blocks:
+                bisect.insort(self.starts, start)
+            self.blocks[start] = data
+
+    def _cached(self, start: int, end: int) -> Optional[bytes]:
+        with self.lock:
+            index = bisect.bisect_right(self.starts, start) - 1
+            if index < 0:
+                return None
+            block_start = self.starts[index]
+            block = self.blocks[block_start]
+            if block_start + len(block) >= end:
+                return block[start - block_start:end - block_start]
+        return None
+
+    def fetch(self, start: int, end: int):
+        """Fetch [start, end) into the cache."""
+        data, _ = self._get(f'bytes={start}-{end - 1}')
+        self._store(start, data)
+
+    def prefetch(self, ranges: Sequence[Tuple[int, int]], max_workers: int = 8,
+                 gap: int = DEFAULT_COALESCE_GAP):
+        """
+        Coalesce ranges and fetch them in parallel.
+
+        Args:
+            ranges: (start, end) pairs, end exclusive
+            max_workers: Concurrent ranged GETs
+            gap: Coalescing gap in bytes
+        """
+        merged = [r for r in coalesce_ranges(ranges, gap) if self._cached(*r) is None]
+        if not merged:
+            return
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(lambda r: self.fetch(*r), merged))
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.size - self.position
+        start = self.position
+        end = min(self.size, start + size)
+        if start >= end:
+            return b''
+
+        data = self._cached(start, end)
+        if data is None:
+            logging.debug(f"Range cache miss for s3://{self.bucket}/{self.key} [{start}, {end})")
+            self.fetch(start, end)
+            data = self._cached(start, end)
+
+        self.position = end
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        if whence == 0:
+            self.position = offset
+        elif whence == 1:
+            self.position += offset
+        else:
+            self.position = self.size + offset
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def writable(self) -> bool:
+        return False
+
+    def close(self):
+        self.closed = True
+        self.blocks = {}
+        self.starts = []
+
+    def footer_range(self) -> Tuple[int, int]:
+        """Return the byte range of the Parquet footer, fetching it if needed."""
+        trailer = self._cached(self.size - 8, self.size)
+        length, magic = struct.unpack('<I4s', trailer)
+        if magic != PARQUET_MAGIC:
+            raise ValueError(f"s3://{self.bucket}/{self.key} is not a Parquet file")
+        start = self.size - 8 - length
+        if self._cached(start, self.size) is None:
+            self.fetch(start, self.size)
+        return start, self.size
+
+
+def _may_match(statistics, op: str, value: Any) -> bool:
+    """Return False only if min/max statistics prove no row can match."""
+    if statistics is None or not statistics.has_min_max:
+        return True
+    low, high = statistics.min, statistics.max
+    try:
+        if op in ('==', '='):
+            return low <= value <= high
+        if op == '!=':
+            return not (low == high == value)
+        if op == '<':
+            return low < value
+        if op == '<=':
+            return low <= value
+        if op == '>':
+            return high > value
+        if op == '>=':
+            return high >= value
+        if op == 'in':
+            return any(low <= v <= high for v in value)
+        if op == 'not in':
+            return not (low == high and low in value)
+    except TypeError:
+        # Statistics of a type the value cannot be compared with
+        return True
+    return True
+
+
+def _row_mask(table, filters: Sequence[Tuple[str, str, Any]]):
+    mask = None
+    for column, op, value in filters:
+        values = table.column(column)
+        if op in ('==', '='):
+            condition = pc.equal(values, value)
+        elif op == '!=':
+            condition = pc.not_equal(values, value)
+        elif op == '<':
+            condition = pc.less(values, value)
+        elif op == '<=':
+            condition = pc.less_equal(values, value)
+        elif op == '>':
+            condition = pc.greater(values, value)
+        elif op == '>=':
+            condition = pc.greater_equal(values, value)
+        elif op == 'in':
+            condition = pc.is_in(values, value_set=pa.array(list(value)))
+        else:
+            condition = pc.invert(pc.is_in(values, value_set=pa.array(list(value))))
+        mask = condition if mask is None else pc.and_(mask, condition)
+    return mask
+
+
+class ParquetS3Reader:
+    """Column- and row-group-pruning Parquet reader for one S3 object."""
+
+    def __init__(self, s3_path: str, region: str = None, max_workers: int = 8,
+                 coalesce_gap: int = DEFAULT_COALESCE_GAP):
+        """
+        Open a Parquet object, fetching only its footer.
+
+        Args:
+            s3_path: S3 path in format s3://bucket/key
+            region: AWS region (defaults to AWS_REGION env var)
+            max_workers: Concurrent ranged GETs for column chunks
+            coalesce_gap: Merge column chunk ranges closer than this
+        """
+        if pa is None:
+            raise ImportError("Parquet support requires the 'pyarrow' package")
+
+        bucket, key = parse_s3_path(s3_path)
+        self.s3_path = s3_path
+        self.max_workers = max_workers
+        self.coalesce_gap = coalesce_gap
+
+        self.file = S3RangeFile(get_s3_client(region), bucket, key)
+        self.file.footer_range()
+        self.parquet = pq.ParquetFile(self.file)
+        self.metadata = self.parquet.metadata
+
+        self.metrics = {
+            'file_bytes': self.file.size,
+            'row_groups_total': self.metadata.num_row_groups,
+            'row_groups_read': 0,
+        }
+
+    def _chunk_range(self, column) -> Tuple[int, int]:
+        start = column.data_page_offset
+        if column.has_dictionary_page and column.dictionary_page_offset:
+            start = min(start, column.dictionary_page_offset)
+        return start, start + column.total_compressed_size
+
+    def prune_row_groups(self, filters: Sequence[Tuple[str, str, Any]] = None) -> List[int]:
+        """
+        Return the row groups whose statistics may satisfy every filter.
+
+        Args:
+            filters: (column, op, value) triples combined with AND
+
+        Returns:
+            Indexes of row groups to read
+        """
+        for _, op, _ in filters or []:
+            if op not in OPERATORS:
+                raise ValueError(f"Unsupported filter operator: {op}")
+
+        kept = []
+        for index in range(self.metadata.num_row_groups):
+            row_group = self.metadata.row_group(index)
+            columns = {
+                row_group.column(j).path_in_schema: row_group.column(j)
+                for j in range(row_group.num_columns)
+            }
+            if all(
+                _may_match(columns[name].statistics if name in columns else None, op, value)
+                for name, op, value in filters or []
+            ):
+                kept.append(index)
+        return kept
+
+    def read(self, columns: Sequence[str] = None,
+             filters: Sequence[Tuple[str, str, Any]] = None):
+        """
+        Read selected columns of the row groups that may match the filters.
+
+        Args:
+            columns: Top-level column names (all columns if None)
+            filters: (column, op, value) triples combined with AND; rows
+                are filtered exactly after row-group pruning
+
+        Returns:
+            pyarrow.Table
+        """
+        start = time.perf_counter()
+        filters = list(filters or [])
+        row_groups = self.prune_row_groups(filters)
+
+        read_columns = None
+        if columns is not None:
+            read_columns = list(columns)
+            for name, _, _ in filters:
+                if name not in read_columns:
+                    read_columns.append(name)
+
+        wanted = set(read_columns) if read_columns is not None else None
+        ranges = []
+        for index in row_groups:
+            row_group = self.metadata.row_group(index)
+            for j in range(row_group.num_columns):
+                column = row_group.column(j)
+                if wanted is None or column.path_in_schema.split('.')[0] in wanted:
+                    ranges.append(self._chunk_range(column))
+
+        self.file.prefetch(ranges, self.max_workers, self.coalesce_gap)
+
+        if row_groups:
+            table = self.parquet.read_row_groups(row_groups, columns=read_columns, use_threads=True)
+        else:
+            table = self.parquet.schema_arrow.empty_table()
+            if read_columns is not None:
+                table = table.select(read_columns)
+
+        if filters and table.num_rows:
+            table = table.filter(_row_mask(table, filters))
+        if columns is not None:
+            table = table.select(list(columns))
+
+        seconds = time.perf_counter() - start
+        self.metrics.update({
+            'row_groups_read': len(row_groups),
+            'bytes_fetched': self.file.bytes_fetched,
+            'requests': self.file.requests,
+            'rows': table.num_rows,
+            'seconds': seconds,
+        })
+        logging.info(
+            f"Read {self.s3_path}: {len(row_groups)}/{self.metadata.num_row_groups} row groups, "
+            f"{self.file.bytes_fetched} of {self.file.size} bytes in "
+            f"{self.file.requests} requests, {seconds:.2f}s"
+        )
+        return table
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self) -> 'ParquetS3Reader':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def read_parquet(s3_path: str, columns: Sequence[str] = None,
+                 filters: Sequence[Tuple[str, str, Any]] = None,
+                 region: str = None, max_workers: int = 8):
+    """
+    Read a Parquet object from S3, fetching only the needed byte ranges.
+
+    Args:
+        s3_path: S3 path in format s3://bucket/key
+        columns: Top-level column names (all columns if None)
+        filters: (column, op, value) triples combined with AND,
+            e.g. [('event_date', '>=', date(2025, 1, 1))]
+        region: AWS region (defaults to AWS_REGION env var)
+        max_workers: Concurrent ranged GETs
+
+    Returns:
+        pyarrow.Table
+    """
+    with ParquetS3Reader(s3_path, region=region, max_workers=max_workers) as reader:
+        return reader.read(columns=columns, filters=filters)
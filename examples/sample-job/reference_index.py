@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped reference index for enrichment lookups.
+
+A read-only key-to-record table stored as one flat file: a hash table of
+(hash, offset) slots followed by the key/value bytes. Workers open it with
+mmap, so every process on a host shares the same page-cache pages, lookups
+are O(1) with no deserialization, and memory stays flat as workers are
+added. The file is built (or downloaded) once per host under a file lock.
+
+Usage:
+    python reference_index.py build customers.jsonl customers.idx --key-field customer_id
+    python reference_index.py get customers.idx 12345
+"""
+
+import argparse
+import array
+import fcntl
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple, Union
+
+from s3_concurrency import get_controller
+from utils import download_from_s3, get_s3_client, parse_s3_path
+
+
+MAGIC = b'BJREFIX1'
+
+# magic, record count, slot count, slot table offset, data offset, data size
+_HEADER = struct.Struct('<8sQQQQQ')
+HEADER_SIZE = 64
+
+# hash, data offset + 1 (0 marks an empty slot)
+_SLOT = struct.Struct('<QQ')
+
+# key length, value length
+_RECORD = struct.Struct('<II')
+
+MAX_LOAD_FACTOR = 0.7
+
+Key = Union[bytes, str]
+
+
+def _key_bytes(key: Any) -> bytes:
+    if isinstance(key, bytes):
+        return key
+    return str(key).encode('utf-8')
+
+
+def _value_bytes(value: Any) -> bytes:
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value)
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def _hash(key: bytes) -> int:
+    # Stable across processes, unlike hash(); never 0 so slots can be probed
+    # without a separate occupancy check on the hash
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little') or 1
+
+
+def _slot_count(records: int) -> int:
+    count = 8
+    while count * MAX_LOAD_FACTOR < records:
+        count *= 2
+    return count
+
+
+def build_index(records: Iterable[Tuple[Any, Any]], path: str) -> int:
+    """
+    Build an index file from (key, value) pairs.
+
+    Keys are encoded as UTF-8 unless already bytes; values are stored as-is
+    if bytes, UTF-8 if str, and compact JSON otherwise. Later duplicates of
+    a key replace earlier ones. The file is written next to ``path`` and
+    renamed into place, so readers never see a partial index.
+
+    Args:
+        records: Iterable of (key, value) pairs
+        path: Destination index path
+
+    Returns:
+        Number of distinct keys
+    """
+    start = time.perf_counter()
+    directory = os.path.dirname(os.path.abspath(path))
+
+    # Pass 1: stream records into a data file, remembering only offsets
+    offsets = array.array('Q')
+    with tempfile.TemporaryFile(dir=directory) as data:
+        for key, value in records:
+            key = _key_bytes(key)
+            value = _value_bytes(value)
+            offsets.append(data.tell())
+            data.write(_RECORD.pack(len(key), len(value)))
+            data.write(key)
+            data.write(value)
+        data_size = data.tell()
+
+        slots = _slot_count(len(offsets))
+        slots_offset = HEADER_SIZE
+        data_offset = slots_offset + slots * _SLOT.size
+        total_size = data_offset + data_size
+
+        fd, tmp_path = tempfile.mkstemp(prefix='.index-', dir=directory)
+        try:
+            with os.fdopen(fd, 'w+b') as out:
+                out.truncate(total_size)
+                out.seek(data_offset)
+                data.seek(0)
+                shutil.copyfileobj(data, out, 1024 * 1024)
+                out.flush()
+
+                # Pass 2: fill the slot table in place
+                with mmap.mmap(out.fileno(), total_size) as view:
+                    distinct = _fill_slots(view, offsets, slots, slots_offset, data_offset)
+                    _HEADER.pack_into(view, 0, MAGIC, distinct, slots,
+                                      slots_offset, data_offset, data_size)
+                    view.flush()
+
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    logging.info(
+        f"Built reference index {path}: {distinct} keys, {total_size} bytes "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+    return distinct
+
+
+def _fill_slots(view: mmap.mmap, offsets, slots: int, slots_offset: int,
+                data_offset: int) -> int:
+    mask = slots - 1
+    distinct = 0
+
+    for offset in offsets:
+        position = data_offset + offset
+        key_length, _ = _RECORD.unpack_from(view, position)
+        key_start = position + _RECORD.size
+        key = view[key_start:key_start + key_length]
+        key_hash = _hash(key)
+
+        index = key_hash & mask
+        while True:
+            slot = slots_offset + index * _SLOT.size
+            slot_hash, slot_offset = _SLOT.unpack_from(view, slot)
+            if slot_offset == 0:
+                distinct += 1
+                break
+            if slot_hash == key_hash and _key_at(view, data_offset + slot_offset - 1) == key:
+                # Duplicate key: the later record wins
+                break
+            index = (index + 1) & mask
+
+        _SLOT.pack_into(view, slot, key_hash, offset + 1)
+
+    return distinct
+
+
+def _key_at(view, position: int) -> bytes:
+    key_length, _ = _RECORD.unpack_from(view, position)
+    start = position + _RECORD.size
+    return bytes(view[start:start + key_length])
+
+
+class ReferenceIndex:
+    """Read-only, memory-mapped view of an index file."""
+
+    def __init__(self, path: str):
+        """
+        Open an index file.
+
+        Args:
+            path: Path to an index built by build_index
+
+        Raises:
+            ValueError: If the file is not a reference index
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+
+        magic, self.records, self.slots, self.slots_offset, self.data_offset, _ = \
+            _HEADER.unpack_from(self.view, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a reference index")
+        self.mask = self.slots - 1
+
+    def _find(self, key: bytes) -> Optional[int]:
+        key_hash = _hash(key)
+        index = key_hash & self.mask
+        view = self.view
+
+        while True:
+            slot_hash, slot_offset = _SLOT.unpack_from(view, self.slots_offset + index * _SLOT.size)
+            if slot_offset == 0:
+                return None
+            if slot_hash == key_hash:
+                position = self.data_offset + slot_offset - 1
+                key_length, _ = _RECORD.unpack_from(view, position)
+                start = position + _RECORD.size
+                if view[start:start + key_length] == key:
+                    return position
+            index = (index + 1) & self.mask
+
+    def get_raw(self, key: Key) -> Optional[memoryview]:
+        """
+        Look up a key without copying.
+
+        Args:
+            key: Key as bytes or str
+
+        Returns:
+            memoryview of the stored value bytes, or None if absent; valid
+            until the index is closed
+        """
+        position = self._find(_key_bytes(key))
+        if position is None:
+            return None
+        key_length, value_length = _RECORD.unpack_from(self.view, position)
+        start = position + _RECORD.size + key_length
+        return self.view[start:start + value_length]
+
+    def get(self, key: Key, default: Any = None,
+            decode: Callable[[memoryview], Any] = None) -> Any:
+        """
+        Look up a key.
+
+        Args:
+            key: Key as bytes or str
+            default: Returned when the key is absent
+            decode: Optional decoder for the value (e.g. json.loads);
+                bytes are returned by default
+
+        Returns:
+            Decoded value, value bytes, or default
+        """
+        view = self.get_raw(key)
+        if view is None:
+            return default
+        value = bytes(view)
+        view.release()
+        if decode is not None:
+            return decode(value)
+        return value
+
+    def __contains__(self, key: Key) -> bool:
+        return self._find(_key_bytes(key)) is not None
+
+    def __len__(self) -> int:
+        return self.records
+
+    def close(self):
+        """
+        Unmap the file.
+
+        If views returned by get_raw are still alive the mapping cannot be
+        closed yet; it is left to be freed with the last view instead of
+        raising.
+        """
+        try:
+            self.view.release()
+            self.mmap.close()
+        except BufferError:
+            logging.warning(f"Reference index {self.path} still has live views; not unmapped")
+
+    def __enter__(self) -> 'ReferenceIndex':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _source_version(source: str) -> str:
+    """Return an identifier that changes whenever the S3 source object does."""
+    bucket, key = parse_s3_path(source)
+    client = get_s3_client()
+    head = get_controller().call(bucket, key, client.head_object, Bucket=bucket, Key=key)
+    return f"{source} {head['ETag']}"
+
+
+def _read_version(path: str) -> Optional[str]:
+    try:
+        with open(path + '.source') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _write_version(path: str, version: str):
+    tmp_path = f"{path}.{os.getpid()}.source"
+    with open(tmp_path, 'w') as f:
+        f.write(version)
+    os.replace(tmp_path, path + '.source')
+
+
+def ensure_index(path: str, source: str = None,
+                 builder: Callable[[], Iterable[Tuple[Any, Any]]] = None) -> ReferenceIndex:
+    """
+    Open the host-local index, building or downloading it first if needed.
+
+    Concurrent callers on the same host serialize on a lock file, so only
+    the first worker builds or downloads; the rest wait and then map the
+    same file. An index downloaded from ``source`` is tagged with the
+    object's ETag (in ``<path>.source``) and downloaded again when the
+    source changes; workers still mapping the old file keep reading it.
+
+    Args:
+        path: Local index path shared by all workers on the host
+        source: S3 path of a prebuilt index to download
+        builder: Callable returning (key, value) pairs, used if no source
+
+    Returns:
+        Opened ReferenceIndex
+
+    Raises:
+        ValueError: If the index is missing and neither source nor
+            builder is given
+    """
+    version = None
+    if source:
+        try:
+            version = _source_version(source)
+        except Exception as e:
+            if not os.path.exists(path):
+                raise
+            logging.warning(f"Could not check {source} ({e}); using existing index {path}")
+
+    def current() -> bool:
+        if not os.path.exists(path):
+            return False
+        return version is None or _read_version(path) == version
+
+    if current():
+        return ReferenceIndex(path)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if not current():
+                if source:
+                    tmp_path = f"{path}.{os.getpid()}.download"
+                    download_from_s3(source, tmp_path)
+                    os.replace(tmp_path, path)
+                    _write_version(path, version)
+                    logging.info(f"Downloaded reference index {source} ({version.rsplit(' ', 1)[1]})")
+                elif builder is not None:
+                    build_index(builder(), path)
+                else:
+                    raise ValueError(f"Reference index {path} is missing and has no source")
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+    return ReferenceIndex(path)
+
+
+def iter_jsonl(path: str, key_field: str) -> Iterator[Tuple[Any, Any]]:
+    """
+    Yield (key, record) pairs from a JSON Lines file.
+
+    Args:
+        path: JSON Lines file
+        key_field: Field holding the lookup key
+
+    Yields:
+        (key, raw JSON line) pairs; the line is stored without re-encoding
+    """
+    with open(path, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)[key_field], line
+
+
+def main():
+    """Main entry point for CLI."""
+    parser = argparse.ArgumentParser(
+        description='Build or query a memory-mapped reference index'
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='Build an index from JSON Lines')
+    build.add_argument('input', help='JSON Lines file of records')
+    build.add_argument('output', help='Index file to write')
+    build.add_argument('--key-field', required=True, help='Record field used as the key')
+
+    get = commands.add_parser('get', help='Look up a key')
+    get.add_argument('index', help='Index file')
+    get.add_argument('key', help='Key to look up')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'build':
+        build_index(iter_jsonl(args.input, args.key_field), args.output)
+    else:
+        with ReferenceIndex(args.index) as index:
+            value = index.get(args.key)
+        if value is None:
+            sys.exit(1)
+        print(value.decode('utf-8'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,560 @@
+"""
+Streaming compression codecs for S3 transfers.
+
+Codecs are picked from the object key extension (``.gz``, ``.zst``) or
+passed explicitly, and applied chunk by chunk so compressed objects never
+have to be held in memory in full.
+"""
+
+import gzip
+import logging
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Dict, IO, Iterable, Iterator, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+from s3_concurrency import get_controller
+
+try:
+    import zstandard
+except ImportError:  # zstd support is optional
+    zstandard = None
+
+
+# Read/compress granularity for streaming transfers
+CHUNK_SIZE = 1024 * 1024
+
+# S3 requires every multipart part except the last to be at least 5 MiB
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+
+# Ranged GET size and the most downloaded-but-unconsumed bytes per download
+DOWNLOAD_PART_SIZE = 8 * 1024 * 1024
+DOWNLOAD_BUFFER_SIZE = 64 * 1024 * 1024
+
+# Concurrent part requests per transfer (S3_TRANSFER_WORKERS overrides)
+DEFAULT_TRANSFER_WORKERS = 8
+
+# Inputs at least this large are compressed with a worker pool
+PARALLEL_THRESHOLD = 32 * 1024 * 1024
+
+# Independent gzip member size for parallel gzip compression
+GZIP_BLOCK_SIZE = 8 * 1024 * 1024
+
+DEFAULT_LEVELS = {
+    'gzip': 6,
+    'zstd': 3,
+}
+
+EXTENSIONS = {
+    '.gz': 'gzip',
+    '.gzip': 'gzip',
+    '.zst': 'zstd',
+    '.zstd': 'zstd',
+}
+
+# Accumulated transfer statistics per codec
+_stats_lock = threading.Lock()
+_codec_stats: Dict[str, Dict[str, float]] = {}
+
+
+def resolve_codec(path: str, codec: Optional[str] = 'auto') -> Optional[str]:
+    """
+    Resolve the codec to use for a path.
+
+    Args:
+        path: S3 path or key
+        codec: Codec name, 'auto' to detect from the extension,
+            or None/'none' for raw bytes
+
+    Returns:
+        Codec name, or None if no compression applies
+
+    Raises:
+        ValueError: If the codec is unknown or not installed
+    """
+    if codec is None or codec == 'none':
+        return None
+
+    if codec == 'auto':
+        lowered = path.lower()
+        for extension, name in EXTENSIONS.items():
+            if lowered.endswith(extension):
+                codec = name
+                break
+        else:
+            return None
+
+    if codec not in DEFAULT_LEVELS:
+        raise ValueError(f"Unknown codec: {codec}")
+
+    if codec == 'zstd' and zstandard is None:
+        raise ValueError("zstd codec requires the 'zstandard' package")
+
+    return codec
+
+
+class CountingReader:
+    """File-like wrapper that counts bytes read from the underlying stream."""
+
+    def __init__(self, raw: IO[bytes]):
+        self.raw = raw
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.raw.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def readable(self) -> bool:
+        return True
+
+    def close(self):
+        self.raw.close()
+
+
+def open_decompressor(raw: IO[bytes], codec: str) -> IO[bytes]:
+    """
+    Wrap a compressed byte stream in a decompressing reader.
+
+    Args:
+        raw: Readable stream of compressed bytes (e.g. an S3 response body)
+        codec: Codec name
+
+    Returns:
+        Readable stream of decompressed bytes
+    """
+    if codec == 'gzip':
+        # GzipFile handles concatenated members, as written by
+        # parallel compression
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def iter_decompressed(raw: IO[bytes], codec: str,
+                      chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Yield decompressed chunks as compressed bytes arrive.
+
+    Args:
+        raw: Readable stream of compressed bytes
+        codec: Codec name
+        chunk_size: Size of decompressed chunks to yield
+
+    Yields:
+        Decompressed byte chunks
+    """
+    reader = open_decompressor(raw, codec)
+    while True:
+        chunk = reader.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def compression_threads(size: Optional[int]) -> int:
+    """
+    Pick the number of compression threads for an input of a given size.
+
+    Args:
+        size: Uncompressed size in bytes, or None if unknown
+
+    Returns:
+        1 for small inputs, otherwise the CPU count (or COMPRESSION_THREADS)
+    """
+    if size is not None and size < PARALLEL_THRESHOLD:
+        return 1
+    configured = os.getenv('COMPRESSION_THREADS')
+    if configured:
+        return max(1, int(configured))
+    return os.cpu_count() or 1
+
+
+def transfer_workers() -> int:
+    """Return the number of concurrent part requests per S3 transfer."""
+    return max(1, int(os.getenv('S3_TRANSFER_WORKERS', DEFAULT_TRANSFER_WORKERS)))
+
+
+def _gzip_block(block: bytes, level: int) -> bytes:
+    # zlib releases the GIL, so blocks compress concurrently in threads
+    return gzip.compress(block, compresslevel=level, mtime=0)
+
+
+def iter_compressed(chunks: Iterable[bytes], codec: str, level: int = None,
+                    threads: int = 1) -> Iterator[bytes]:
+    """
+    Compress a stream of chunks on the fly.
+
+    With ``threads > 1``, zstd uses its native multi-threaded compressor and
+    gzip compresses fixed-size blocks in parallel as independent members,
+    which any gzip reader decodes as a single stream.
+
+    Args:
+        chunks: Iterable of uncompressed byte chunks
+        codec: Codec name
+        level: Compression level (defaults to the codec default)
+        threads: Number of compression threads
+
+    Yields:
+        Compressed byte chunks
+    """
+    if level is None:
+        level = DEFAULT_LEVELS[codec]
+
+    if codec == 'zstd':
+        compressor = zstandard.ZstdCompressor(
+            level=level,
+            threads=threads if threads > 1 else 0
+        ).compressobj()
+        for chunk in chunks:
+            out = compressor.compress(chunk)
+            if out:
+                yield out
+        yield compressor.flush()
+        return
+
+    if codec != 'gzip':
+        raise ValueError(f"Unknown codec: {codec}")
+
+    if threads <= 1:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            out = compressor.compress(chunk)
+            if out:
+                yield out
+        yield compressor.flush()
+        return
+
+    # Parallel gzip: keep at most 2 * threads blocks in flight and emit
+    # members in input order
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = []
+        for block in _rechunk(chunks, GZIP_BLOCK_SIZE):
+            pending.append(executor.submit(_gzip_block, block, level))
+            if len(pending) >= 2 * threads:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+def _rechunk(chunks: Iterable[bytes], size: int) -> Iterator[bytes]:
+    """Regroup a stream of chunks into blocks of ``size`` bytes (last may be short)."""
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= size:
+            yield bytes(buffer[:size])
+            del buffer[:size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def iter_source(data: Any, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Yield chunks from bytes, a string, a file path or a readable stream.
+
+    Args:
+        data: Source data
+        chunk_size: Chunk size for file and stream sources
+
+    Yields:
+        Byte chunks
+    """
+    if isinstance(data, str):
+        if os.path.isfile(data):
+            with open(data, 'rb') as f:
+                yield from iter_source(f, chunk_size)
+            return
+        data = data.encode('utf-8')
+
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        view = memoryview(data)
+        for offset in range(0, len(view), chunk_size):
+            yield bytes(view[offset:offset + chunk_size])
+        return
+
+    while True:
+        chunk = data.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+class IteratorReader:
+    """File-like reader over an iterator of byte chunks."""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self.chunks = iter(chunks)
+        self.current = b''
+        self.position = 0
+
+    def read(self, size: int = -1) -> bytes:
+        pieces = []
+        while size is None or size < 0 or size > 0:
+            if self.position >= len(self.current):
+                chunk = next(self.chunks, None)
+                if chunk is None:
+                    break
+                self.current, self.position = chunk, 0
+                continue
+            end = len(self.current) if size is None or size < 0 else self.position + size
+            piece = self.current[self.position:end]
+            self.position += len(piece)
+            if size is not None and size > 0:
+                size -= len(piece)
+            pieces.append(piece)
+        return b''.join(pieces)
+
+    def readable(self) -> bool:
+        return True
+
+    def close(self):
+        close = getattr(self.chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+class CountingIterator:
+    """Iterator wrapper that counts the bytes passing through it."""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self.bytes_seen = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        chunk = next(self._chunks)
+        self.bytes_seen += len(chunk)
+        return chunk
+
+
+def multipart_upload(client, bucket: str, key: str, chunks: Iterable[bytes],
+                     part_size: int = DEFAULT_PART_SIZE, max_workers: int = 1,
+                     **extra_args) -> int:
+    """
+    Upload a stream of chunks to S3 without buffering the whole object.
+
+    Objects smaller than one part are sent with a single PutObject;
+    larger ones use a multipart upload that is aborted on failure. Every
+    request runs under the shared adaptive concurrency controller.
+
+    Args:
+        client: boto3 S3 client
+        bucket: Bucket name
+        key: Object key
+        chunks: Iterable of byte chunks
+        part_size: Multipart part size in bytes
+        max_workers: Parts uploaded concurrently (at most 2 * max_workers
+            parts are held in memory)
+        **extra_args: Extra arguments for PutObject/CreateMultipartUpload
+
+    Returns:
+        Number of bytes uploaded
+    """
+    controller = get_controller()
+    part_size = max(part_size, MIN_PART_SIZE)
+    parts = _rechunk(chunks, part_size)
+
+    first = next(parts, b'')
+    second = next(parts, None)
+    if second is None:
+        controller.call(
+            bucket, key, client.put_object,
+            Bucket=bucket, Key=key, Body=first, **extra_args
+        )
+        return len(first)
+
+    upload_id = controller.call(
+        bucket, key, client.create_multipart_upload,
+        Bucket=bucket, Key=key, **extra_args
+    )['UploadId']
+    def upload_part(number: int, body: bytes) -> Dict[str, Any]:
+        response = controller.call(
+            bucket, key, client.upload_part,
+            Bucket=bucket, Key=key, UploadId=upload_id,
+            PartNumber=number, Body=body
+        )
+        return {'ETag': response['ETag'], 'PartNumber': number}
+
+    completed = []
+    total = 0
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            pending = []
+            for number, body in enumerate(_chain(first, second, parts), start=1):
+                pending.append(executor.submit(upload_part, number, body))
+                total += len(body)
+                if len(pending) >= 2 * max_workers:
+                    completed.append(pending.pop(0).result())
+            completed.extend(future.result() for future in pending)
+
+        controller.call(
+            bucket, key, client.complete_multipart_upload,
+            Bucket=bucket, Key=key, UploadId=upload_id,
+            MultipartUpload={'Parts': completed}
+        )
+    except Exception:
+        client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+
+    return total
+
+
+def _read_range(client, bucket: str, key: str, **kwargs) -> Tuple[bytes, Dict[str, Any]]:
+    # The body is read inside the request so that the concurrency slot is
+    # held, and failures retried, for the whole transfer and not just the
+    # response headers
+    response = client.get_object(Bucket=bucket, Key=key, **kwargs)
+    return response['Body'].read(), response
+
+
+def ranged_download(client, bucket: str, key: str, part_size: int = DOWNLOAD_PART_SIZE,
+                    max_workers: int = 1,
+                    max_buffer: int = DOWNLOAD_BUFFER_SIZE) -> Iterator[bytes]:
+    """
+    Download an object as parallel ranged GETs, yielding parts in order.
+
+    The first part's Content-Range gives the object size, so small objects
+    take a single request. Remaining parts are pinned to the first part's
+    ETag, so an object replaced mid-download fails instead of mixing
+    versions. Every request runs under the shared adaptive concurrency
+    controller. Closing the iterator early cancels outstanding parts.
+
+    Args:
+        client: boto3 S3 client
+        bucket: Bucket name
+        key: Object key
+        part_size: Bytes per ranged GET
+        max_workers: Parts downloaded concurrently
+        max_buffer: Bytes of parts fetched ahead of the consumer (at
+            least one part)
+
+    Yields:
+        Object bytes, one part at a time
+    """
+    controller = get_controller()
+    try:
+        first, response = controller.call(
+            bucket, key, _read_range, client, bucket, key,
+            operation='get_object', Range=f"bytes=0-{part_size - 1}"
+        )
+    except ClientError as e:
+        # A range is never satisfiable on an empty object
+        if e.response.get('Error', {}).get('Code') == 'InvalidRange':
+            return
+        raise
+
+    content_range = response.get('ContentRange')
+    size = int(content_range.rsplit('/', 1)[1]) if content_range else len(first)
+    if size <= len(first):
+        yield first
+        return
+
+    extra_args = {'IfMatch': response['ETag']} if response.get('ETag') else {}
+    ranges = (
+        f"bytes={offset}-{min(offset + part_size, size) - 1}"
+        for offset in range(len(first), size, part_size)
+    )
+    window = max(1, min(2 * max_workers, max_buffer // part_size))
+
+    def fetch(byte_range: str) -> bytes:
+        return controller.call(
+            bucket, key, _read_range, client, bucket, key,
+            operation='get_object_part', Range=byte_range, **extra_args
+        )[0]
+
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    try:
+        pending = [executor.submit(fetch, byte_range) for byte_range in islice(ranges, window)]
+        yield first
+        del first
+        while pending:
+            part = pending.pop(0).result()
+            for byte_range in islice(ranges, 1):
+                pending.append(executor.submit(fetch, byte_range))
+            yield part
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _chain(first: bytes, second: bytes, rest: Iterator[bytes]) -> Iterator[bytes]:
+    yield first
+    yield second
+    yield from rest
+
+
+def record_stats(codec: str, direction: str, raw_bytes: int,
+                 compressed_bytes: int, seconds: float) -> Dict[str, float]:
+    """
+    Record and log throughput and ratio for one codec transfer.
+
+    Args:
+        codec: Codec name
+        direction: 'download' or 'upload'
+        raw_bytes: Uncompressed byte count
+        compressed_bytes: Compressed byte count
+        seconds: Wall-clock duration
+
+    Returns:
+        Statistics for this transfer
+    """
+    seconds = max(seconds, 1e-9)
+    stats = {
+        'codec': codec,
+        'direction': direction,
+        'raw_bytes': raw_bytes,
+        'compressed_bytes': compressed_bytes,
+        'seconds': seconds,
+        'ratio': raw_bytes / compressed_bytes if compressed_bytes else 0.0,
+        'throughput_mbps': raw_bytes / seconds / (1024 * 1024),
+    }
+
+    with _stats_lock:
+        totals = _codec_stats.setdefault(codec, {
+            'raw_bytes': 0,
+            'compressed_bytes': 0,
+            'seconds': 0.0,
+            'transfers': 0,
+        })
+        totals['raw_bytes'] += raw_bytes
+        totals['compressed_bytes'] += compressed_bytes
+        totals['seconds'] += seconds
+        totals['transfers'] += 1
+
+    logging.info(
+        f"{codec} {direction}: {raw_bytes} raw / {compressed_bytes} compressed bytes, "
+        f"ratio {stats['ratio']:.2f}, {stats['throughput_mbps']:.1f} MiB/s"
+    )
+    return stats
+
+
+def codec_stats() -> Dict[str, Dict[str, float]]:
+    """
+    Return accumulated statistics per codec.
+
+    Returns:
+        Mapping of codec name to totals, including overall ratio and
+        throughput in MiB/s of uncompressed data
+    """
+    with _stats_lock:
+        report = {}
+        for codec, totals in _codec_stats.items():
+            entry = dict(totals)
+            entry['ratio'] = (
+                totals['raw_bytes'] / totals['compressed_bytes']
+                if totals['compressed_bytes'] else 0.0
+            )
+            entry['throughput_mbps'] = (
+                totals['raw_bytes'] / max(totals['seconds'], 1e-9) / (1024 * 1024)
+            )
+            report[codec] = entry
+        return report
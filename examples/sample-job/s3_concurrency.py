@@ -0,0 +1,321 @@
+"""
+Adaptive request concurrency for S3.
+
+Every S3 read and write goes through a shared controller that keeps an
+additive-increase/multiplicative-decrease (AIMD) limit per bucket and key
+prefix. The limit creeps up while latency and error rates stay healthy and
+is cut when S3 answers with SlowDown/503, so throughput converges on the
+highest request rate a prefix will sustain without manual tuning.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Tuple
+
+from botocore.exceptions import (
+    ClientError,
+    ConnectionClosedError,
+    EndpointConnectionError,
+    ReadTimeoutError
+)
+
+
+# Error codes S3 uses to ask callers to slow down
+THROTTLING_ERRORS = {
+    'SlowDown',
+    'Throttling',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+    'TooManyRequests',
+    '503',
+    'ServiceUnavailable',
+}
+
+# Server-side errors worth retrying that are not throttling
+TRANSIENT_ERRORS = {
+    'InternalError',
+    '500',
+    'RequestTimeout',
+}
+
+CONNECTION_ERRORS = (ConnectionClosedError, EndpointConnectionError, ReadTimeoutError)
+
+
+def classify_error(error: Exception) -> str:
+    """
+    Classify an exception raised by an S3 call.
+
+    Args:
+        error: Exception raised by boto3
+
+    Returns:
+        'throttled', 'transient' or 'fatal'
+    """
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code', '')
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+        if code in THROTTLING_ERRORS or status == 503:
+            return 'throttled'
+        if code in TRANSIENT_ERRORS or (status is not None and status >= 500):
+            return 'transient'
+        return 'fatal'
+    if isinstance(error, CONNECTION_ERRORS):
+        return 'transient'
+    return 'fatal'
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit for a single bucket/prefix."""
+
+    def __init__(self, initial: int = 8, minimum: int = 1, maximum: int = 256,
+                 decrease_factor: float = 0.5, latency_tolerance: float = 2.0,
+                 error_threshold: float = 0.05, cooldown: float = 1.0):
+        """
+        Initialize the limiter.
+
+        Args:
+            initial: Starting number of allowed in-flight requests
+            minimum: Lower bound on the limit
+            maximum: Upper bound on the limit
+            decrease_factor: Multiplier applied to the limit on throttling
+            latency_tolerance: Stop growing once latency exceeds this
+                multiple of the best latency observed for the same
+                operation
+            error_threshold: Error rate that triggers a decrease
+            cooldown: Minimum seconds between two decreases, so a burst of
+                throttles from one overloaded window counts once
+        """
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self.last_decrease = 0.0
+
+        # Latency is tracked per operation: a HEAD or small PUT is far faster
+        # than a 16 MiB ranged GET, and must not set the bar for it
+        self.latency: Dict[str, Dict[str, float]] = {}
+        self.error_rate = 0.0
+
+        self.requests = 0
+        self.throttles = 0
+        self.errors = 0
+        self.peak_in_flight = 0
+
+    def acquire(self):
+        """Block until a request slot is free, then take it."""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def release(self, latency: float, outcome: str, operation: str = 'request'):
+        """
+        Return a request slot and adapt the limit.
+
+        Args:
+            latency: Request latency in seconds
+            outcome: 'ok', 'throttled', 'transient' or 'fatal'
+            operation: Kind of request, e.g. 'head_object'; latency is
+                only compared between requests of the same kind
+        """
+        with self.condition:
+            self.in_flight -= 1
+            self.requests += 1
+
+            failed = outcome in ('throttled', 'transient')
+            self.error_rate = 0.95 * self.error_rate + 0.05 * (1.0 if failed else 0.0)
+
+            if outcome == 'throttled':
+                self.throttles += 1
+                self._decrease()
+            elif outcome == 'transient':
+                self.errors += 1
+                if self.error_rate > self.error_threshold:
+                    self._decrease()
+            elif outcome == 'ok':
+                stats = self._observe_latency(operation, latency)
+                if self._healthy(stats):
+                    # Roughly +1 per limit's worth of successful requests
+                    self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+            self.condition.notify_all()
+
+    def _observe_latency(self, operation: str, latency: float) -> Dict[str, float]:
+        stats = self.latency.get(operation)
+        if stats is None:
+            stats = self.latency[operation] = {'ewma': latency, 'floor': latency}
+        else:
+            stats['ewma'] = 0.9 * stats['ewma'] + 0.1 * latency
+            stats['floor'] = min(stats['floor'], latency)
+        return stats
+
+    def _healthy(self, stats: Dict[str, float]) -> bool:
+        if self.error_rate > self.error_threshold:
+            return False
+        if stats['floor'] and stats['ewma'] > stats['floor'] * self.latency_tolerance:
+            return False
+        # Only grow when the current limit is actually being used
+        return self.in_flight + 1 >= int(self.limit)
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self.last_decrease < self.cooldown:
+            return
+        self.last_decrease = now
+        self.limit = max(self.minimum, self.limit * self.decrease_factor)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current limit, in-flight count and counters."""
+        with self.condition:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'peak_in_flight': self.peak_in_flight,
+                'requests': self.requests,
+                'throttles': self.throttles,
+                'errors': self.errors,
+                'latency_ms': {
+                    operation: stats['ewma'] * 1000
+                    for operation, stats in self.latency.items()
+                },
+            }
+
+
+class S3ConcurrencyController:
+    """Shared registry of adaptive limiters keyed by bucket and key prefix."""
+
+    def __init__(self, prefix_depth: int = 1, max_attempts: int = 10,
+                 base_delay: float = 0.1, max_delay: float = 10.0,
+                 **limiter_args):
+        """
+        Initialize the controller.
+
+        Args:
+            prefix_depth: Number of leading key path segments that identify
+                a prefix (0 tracks whole buckets)
+            max_attempts: Attempts per request on throttling/transient errors
+            base_delay: Initial retry backoff in seconds
+            max_delay: Retry backoff cap in seconds
+            **limiter_args: Arguments for each AdaptiveLimiter
+        """
+        self.prefix_depth = prefix_depth
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limiter_args = limiter_args
+
+        self.lock = threading.Lock()
+        self.limiters: Dict[Tuple[str, str], AdaptiveLimiter] = {}
+
+    def prefix_of(self, key: str) -> str:
+        """Return the tracked prefix for an object key."""
+        if self.prefix_depth <= 0:
+            return ''
+        segments = key.split('/')[:-1]
+        return '/'.join(segments[:self.prefix_depth])
+
+    def limiter(self, bucket: str, key: str) -> AdaptiveLimiter:
+        """Return the limiter for the bucket/prefix of a key."""
+        scope = (bucket, self.prefix_of(key))
+        with self.lock:
+            if scope not in self.limiters:
+                self.limiters[scope] = AdaptiveLimiter(**self.limiter_args)
+            return self.limiters[scope]
+
+    @contextmanager
+    def slot(self, bucket: str, key: str, operation: str = 'request') -> Iterator[None]:
+        """
+        Hold one request slot for the duration of the block.
+
+        Exceptions raised inside the block are classified and fed back
+        into the limiter before being re-raised. Latency is tracked per
+        operation name.
+        """
+        limiter = self.limiter(bucket, key)
+        limiter.acquire()
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            yield
+        except Exception as e:
+            outcome = classify_error(e)
+            raise
+        finally:
+            limiter.release(time.perf_counter() - start, outcome, operation)
+
+    def call(self, bucket: str, key: str, func: Callable, *args,
+             operation: str = None, **kwargs) -> Any:
+        """
+        Run one S3 request under the adaptive limit, retrying throttled
+        and transient failures with jittered exponential backoff.
+
+        Args:
+            bucket: Bucket the request targets
+            key: Object key (or prefix) the request targets
+            func: boto3 client method to call
+            *args: Positional arguments for func
+            operation: Name latency is tracked under (defaults to the
+                name of func, e.g. 'put_object')
+            **kwargs: Keyword arguments for func
+
+        Returns:
+            Result of func
+        """
+        operation = operation or getattr(func, '__name__', 'request')
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                with self.slot(bucket, key, operation):
+                    return func(*args, **kwargs)
+            except Exception as e:
+                if classify_error(e) == 'fatal' or attempt == self.max_attempts:
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                logging.debug(f"S3 request to s3://{bucket}/{key} failed ({e}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Return per-prefix concurrency and throttle metrics.
+
+        Returns:
+            Mapping of 's3://bucket/prefix' to limiter snapshot
+        """
+        with self.lock:
+            scopes = list(self.limiters.items())
+        return {
+            f"s3://{bucket}/{prefix}": limiter.snapshot()
+            for (bucket, prefix), limiter in scopes
+        }
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller() -> S3ConcurrencyController:
+    """
+    Return the process-wide controller shared by all S3 helpers.
+
+    Tuned through S3_INITIAL_CONCURRENCY, S3_MAX_CONCURRENCY and
+    S3_PREFIX_DEPTH.
+    """
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = S3ConcurrencyController(
+                prefix_depth=int(os.getenv('S3_PREFIX_DEPTH', '1')),
+                initial=int(os.getenv('S3_INITIAL_CONCURRENCY', '8')),
+                maximum=int(os.getenv('S3_MAX_CONCURRENCY', '256'))
+            )
+        return _controller
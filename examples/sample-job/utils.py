@@ -2,14 +2,65 @@
 Utility functions for AWS Batch jobs.
 """
 
+import io
 import os
 import json
 import logging
 import sys
+import threading
+import time
 from typing import Any, Optional
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+from s3_codecs import (
+    CountingIterator,
+    CountingReader,
+    IteratorReader,
+    compression_threads,
+    iter_compressed,
+    iter_decompressed,
+    iter_source,
+    multipart_upload,
+    ranged_download,
+    record_stats,
+    resolve_codec,
+    transfer_workers
+)
+from s3_concurrency import get_controller
+
+
+_s3_clients = {}
+_s3_clients_lock = threading.Lock()
+
+
+def get_s3_client(region: str = None):
+    """
+    Return a shared S3 client for a region.
+    
+    Botocore's own retries are disabled: throttling and transient errors
+    are retried by the adaptive concurrency controller, which needs to see
+    them to adjust its limits.
+    
+    Args:
+        region: AWS region (defaults to AWS_REGION env var)
+        
+    Returns:
+        boto3 S3 client
+    """
+    if region is None:
+        region = os.getenv('AWS_REGION', 'us-east-1')
+    
+    with _s3_clients_lock:
+        if region not in _s3_clients:
+            config = Config(
+                max_pool_connections=int(os.getenv('S3_MAX_CONCURRENCY', '256')),
+                retries={'max_attempts': 1, 'mode': 'standard'}
+            )
+            _s3_clients[region] = boto3.client('s3', region_name=region, config=config)
+        return _s3_clients[region]
+
 
 def setup_logging(level: str = None) -> logging.Logger:
     """
@@ -143,14 +194,21 @@ def put_metric(metric_name: str, value: float, unit: str = 'Count',
         logging.warning(f"Error publishing metric {metric_name}: {e}")
 
 
-def download_from_s3(s3_path: str, local_path: str = None, region: str = None) -> Optional[bytes]:
+def download_from_s3(s3_path: str, local_path: str = None, region: str = None,
+                     codec: str = None) -> Optional[bytes]:
     """
     Download a file from S3.
     
+    Large objects are fetched as parallel ranged GETs (S3_TRANSFER_WORKERS
+    at a time, with bounded read-ahead) under the shared concurrency
+    controller.
+    
     Args:
         s3_path: S3 path in format s3://bucket/key
         local_path: Local file path to save to (optional)
         region: AWS region (defaults to AWS_REGION env var)
+        codec: Decompress on the fly with this codec ('gzip', 'zstd'),
+            'auto' to detect from the key extension, or None for raw bytes
         
     Returns:
         File contents as bytes if local_path is None, otherwise None
@@ -169,21 +227,30 @@ def download_from_s3(s3_path: str, local_path: str = None, region: str = None) -
     
     bucket, key = parts
     
-    if region is None:
-        region = os.getenv('AWS_REGION', 'us-east-1')
-    
-    client = boto3.client('s3', region_name=region)
+    client = get_s3_client(region)
+    codec = resolve_codec(key, codec)
     
     try:
+        parts = ranged_download(client, bucket, key, max_workers=transfer_workers())
+        
+        if codec:
+            # Stream through the decompressor as parts arrive
+            return _download_decompressed(IteratorReader(parts), s3_path, local_path, codec)
+        
         if local_path:
-            # Download to file
-            client.download_file(bucket, key, local_path)
+            # Stream to file
+            with open(local_path, 'wb') as f:
+                for part in parts:
+                    f.write(part)
             logging.info(f"Downloaded {s3_path} to {local_path}")
             return None
         else:
-            # Download to memory
-            response = client.get_object(Bucket=bucket, Key=key)
-            data = response['Body'].read()
+            # Download to memory; BytesIO hands over its buffer without
+            # a second full copy
+            buffer = io.BytesIO()
+            for part in parts:
+                buffer.write(part)
+            data = buffer.getvalue()
             logging.info(f"Downloaded {s3_path} ({len(data)} bytes)")
             return data
             
@@ -192,7 +259,9 @@ def download_from_s3(s3_path: str, local_path: str = None, region: str = None) -
         raise
 
 
-def upload_to_s3(s3_path: str, data: Any, region: str = None, content_type: str = None):
+def upload_to_s3(s3_path: str, data: Any, region: str = None, content_type: str = None,
+                 codec: str = None, compression_level: int = None,
+                 compression_threads: int = None):
     """
     Upload data to S3.
     
@@ -201,6 +270,11 @@ def upload_to_s3(s3_path: str, data: Any, region: str = None, content_type: str
         data: Data to upload (bytes, string, or file path)
         region: AWS region (defaults to AWS_REGION env var)
         content_type: Content type for the object
+        codec: Compress on the fly with this codec ('gzip', 'zstd'),
+            'auto' to detect from the key extension, or None for raw bytes
+        compression_level: Codec compression level (defaults per codec)
+        compression_threads: Compression threads (defaults to all CPUs
+            for large inputs, 1 otherwise)
         
     Raises:
         ValueError: If S3 path format is invalid
@@ -216,25 +290,36 @@ def upload_to_s3(s3_path: str, data: Any, region: str = None, content_type: str
     
     bucket, key = parts
     
-    if region is None:
-        region = os.getenv('AWS_REGION', 'us-east-1')
-    
-    client = boto3.client('s3', region_name=region)
+    client = get_s3_client(region)
+    controller = get_controller()
+    codec = resolve_codec(key, codec)
     
     try:
         extra_args = {}
         if content_type:
             extra_args['ContentType'] = content_type
         
-        if isinstance(data, str) and os.path.isfile(data):
-            # Upload from file
-            client.upload_file(data, bucket, key, ExtraArgs=extra_args or None)
+        if codec:
+            # Compress while uploading parts
+            _upload_compressed(
+                client, bucket, key, s3_path, data, codec,
+                compression_level, compression_threads, extra_args
+            )
+        elif isinstance(data, str) and os.path.isfile(data):
+            # Upload from file in streamed parts
+            multipart_upload(
+                client, bucket, key, iter_source(data),
+                max_workers=transfer_workers(), **extra_args
+            )
             logging.info(f"Uploaded {data} to {s3_path}")
         else:
             # Upload from memory
             if isinstance(data, str):
                 data = data.encode('utf-8')
-            client.put_object(Bucket=bucket, Key=key, Body=data, **extra_args)
+            controller.call(
+                bucket, key, client.put_object,
+                Bucket=bucket, Key=key, Body=data, **extra_args
+            )
             logging.info(f"Uploaded {len(data)} bytes to {s3_path}")
             
     except ClientError as e:
@@ -242,6 +327,56 @@ def upload_to_s3(s3_path: str, data: Any, region: str = None, content_type: str
         raise
 
 
+def _download_decompressed(raw, s3_path: str, local_path: Optional[str],
+                           codec: str) -> Optional[bytes]:
+    """Stream an object body through a decompressor into a file or memory."""
+    start = time.perf_counter()
+    body = CountingReader(raw)
+    raw_bytes = 0
+    
+    if local_path:
+        with open(local_path, 'wb') as f:
+            for chunk in iter_decompressed(body, codec):
+                f.write(chunk)
+                raw_bytes += len(chunk)
+        result = None
+        logging.info(f"Downloaded {s3_path} to {local_path} ({codec}, {raw_bytes} bytes)")
+    else:
+        buffer = bytearray()
+        for chunk in iter_decompressed(body, codec):
+            buffer += chunk
+        raw_bytes = len(buffer)
+        result = bytes(buffer)
+        logging.info(f"Downloaded {s3_path} ({codec}, {raw_bytes} bytes)")
+    
+    record_stats(codec, 'download', raw_bytes, body.bytes_read, time.perf_counter() - start)
+    return result
+
+
+def _upload_compressed(client, bucket: str, key: str, s3_path: str, data: Any,
+                       codec: str, level: Optional[int], threads: Optional[int],
+                       extra_args: dict):
+    """Compress data on the fly and upload it in multipart parts."""
+    if threads is None:
+        size = None
+        if isinstance(data, str) and os.path.isfile(data):
+            size = os.path.getsize(data)
+        elif isinstance(data, (str, bytes, bytearray)):
+            size = len(data)
+        threads = compression_threads(size)
+    
+    start = time.perf_counter()
+    source = CountingIterator(iter_source(data))
+    compressed = multipart_upload(
+        client, bucket, key,
+        iter_compressed(source, codec, level=level, threads=threads),
+        max_workers=transfer_workers(), **extra_args
+    )
+    
+    logging.info(f"Uploaded {source.bytes_seen} bytes to {s3_path} ({codec}, {compressed} bytes stored)")
+    record_stats(codec, 'upload', source.bytes_seen, compressed, time.perf_counter() - start)
+
+
 def parse_s3_path(s3_path: str) -> tuple:
     """
     Parse an S3 path into bucket and key.
@@ -0,0 +1,616 @@
+#!/usr/bin/env python3
+"""
+AWS Batch Bulk Job Submitter
+
+Submit many jobs from a batch spec through a single pooled Batch client.
+Submissions run concurrently under a token-bucket rate limit, throttled
+calls are retried with jittered backoff, and ``dependsOn`` references
+between jobs are resolved by submitting the dependency DAG in
+topological waves.
+
+Usage:
+    python submit_jobs.py spec.json --concurrency 32 --rate 20 --wait
+
+Spec format:
+    {
+      "jobQueue": "my-queue",
+      "jobDefinition": "my-job-def",
+      "environment": {"ENVIRONMENT": "prod"},
+      "jobs": [
+        {"name": "extract", "arraySize": 100,
+         "environment": {"INPUT_PATH": "s3://bucket/in"}},
+        {"name": "aggregate", "dependsOn": ["extract"]},
+        {"name": "per-shard", "arraySize": 100,
+         "dependsOn": [{"name": "extract", "type": "N_TO_N"}]}
+      ]
+    }
+
+Pass ``--endpoint-url`` to run against a local stub of the Batch API
+(e.g. moto in server mode).
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import (
+    ClientError,
+    ConnectionClosedError,
+    ConnectTimeoutError,
+    EndpointConnectionError,
+    ReadTimeoutError
+)
+
+
+logger = logging.getLogger('batch-submitter')
+
+# Error codes the Batch API returns when a caller exceeds its request rate
+THROTTLING_ERRORS = {
+    'TooManyRequestsException',
+    'ThrottlingException',
+    'Throttling',
+    'RequestLimitExceeded',
+}
+
+# Server-side errors worth retrying that are not throttling
+TRANSIENT_ERRORS = {
+    'ServerException',
+    'InternalFailure',
+    'ServiceUnavailable',
+}
+
+CONNECTION_ERRORS = (
+    ConnectionClosedError,
+    ConnectTimeoutError,
+    EndpointConnectionError,
+    ReadTimeoutError,
+)
+
+# DescribeJobs accepts at most 100 job IDs per call
+DESCRIBE_BATCH_SIZE = 100
+
+TERMINAL_STATUSES = {'SUCCEEDED', 'FAILED'}
+
+# A job DescribeJobs has not returned for this many consecutive polls is
+# given up on as UNKNOWN (new jobs can briefly be missing from results)
+MISSING_POLL_LIMIT = 3
+
+
+class TokenBucket:
+    """Thread-safe token bucket limiting calls to ``rate`` per second."""
+
+    def __init__(self, rate: float, burst: int = None):
+        """
+        Initialize the bucket.
+
+        Args:
+            rate: Sustained tokens per second
+            burst: Bucket capacity (defaults to one second of tokens)
+        """
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then consume it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+class SpecError(ValueError):
+    """Raised when a batch spec is malformed or its dependencies form a cycle."""
+
+
+def load_spec(path: str) -> Dict[str, Any]:
+    """
+    Load a batch spec from a JSON file.
+
+    Args:
+        path: Path to the spec file
+
+    Returns:
+        Parsed spec
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+def _dependency_name(dependency: Any) -> str:
+    return dependency['name'] if isinstance(dependency, dict) else dependency
+
+
+def plan_waves(jobs: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """
+    Group jobs into topological waves.
+
+    Every job in a wave depends only on jobs in earlier waves, so a wave can
+    be submitted concurrently once the previous waves have job IDs.
+
+    Args:
+        jobs: Job entries from the spec
+
+    Returns:
+        List of waves, each a list of job entries
+
+    Raises:
+        SpecError: On duplicate names, unknown dependencies or cycles
+    """
+    by_name = {}
+    for job in jobs:
+        name = job.get('name')
+        if not name:
+            raise SpecError("Every job needs a 'name'")
+        if name in by_name:
+            raise SpecError(f"Duplicate job name: {name}")
+        by_name[name] = job
+
+    remaining = {}
+    dependents = {name: [] for name in by_name}
+    for name, job in by_name.items():
+        dependencies = {_dependency_name(d) for d in job.get('dependsOn', [])}
+        for dependency in dependencies:
+            if dependency not in by_name:
+                raise SpecError(f"Job {name} depends on unknown job {dependency}")
+            dependents[dependency].append(name)
+        remaining[name] = len(dependencies)
+
+    waves = []
+    ready = [name for name, count in remaining.items() if count == 0]
+    while ready:
+        waves.append([by_name[name] for name in ready])
+        next_ready = []
+        for name in ready:
+            del remaining[name]
+            for dependent in dependents[name]:
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    next_ready.append(dependent)
+        ready = next_ready
+
+    if remaining:
+        raise SpecError(f"Dependency cycle between jobs: {', '.join(sorted(remaining))}")
+
+    return waves
+
+
+class BatchSubmitter:
+    """Concurrent, rate-limited submitter for a batch spec."""
+
+    def __init__(self, client, concurrency: int = 16, rate: float = 10.0,
+                 burst: int = None, max_retries: int = 8,
+                 base_delay: float = 0.2, max_delay: float = 20.0):
+        """
+        Initialize the submitter.
+
+        Args:
+            client: boto3 Batch client (shared by all worker threads)
+            concurrency: Maximum in-flight API calls
+            rate: Maximum API calls per second
+            burst: Token bucket capacity
+            max_retries: Retries per call on throttling or transient errors
+            base_delay: Initial backoff delay in seconds
+            max_delay: Backoff delay cap in seconds
+        """
+        self.client = client
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.metrics_lock = threading.Lock()
+        self.metrics = {
+            'submitted': 0,
+            'failed': 0,
+            'throttled': 0,
+            'retried_errors': 0,
+            'api_calls': 0,
+        }
+
+        # Filled in as jobs are submitted, so callers can report partial
+        # progress if submission is interrupted
+        self.job_ids: Dict[str, str] = {}
+
+    def _count(self, metric: str, amount: int = 1):
+        with self.metrics_lock:
+            self.metrics[metric] += amount
+
+    def _call(self, operation: str, **kwargs) -> Dict[str, Any]:
+        """
+        Call a Batch API operation with rate limiting, retrying throttled,
+        server-side and connection failures.
+        """
+        method = getattr(self.client, operation)
+
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            self._count('api_calls')
+            try:
+                return method(**kwargs)
+            except ClientError as e:
+                code = e.response.get('Error', {}).get('Code')
+                status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+                if code in THROTTLING_ERRORS:
+                    self._count('throttled')
+                elif code in TRANSIENT_ERRORS or status >= 500:
+                    self._count('retried_errors')
+                else:
+                    raise
+                if attempt == self.max_retries:
+                    raise
+                reason = code
+            except CONNECTION_ERRORS as e:
+                # Note: a SubmitJob whose response was lost may already
+                # have been accepted, so a retry can create a duplicate job
+                self._count('retried_errors')
+                if attempt == self.max_retries:
+                    raise
+                reason = type(e).__name__
+
+            # Full jitter keeps retrying workers from synchronizing
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+            logger.debug(f"{operation} failed ({reason}), retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+    def _build_request(self, job: Dict[str, Any], defaults: Dict[str, Any],
+                       job_ids: Dict[str, str]) -> Dict[str, Any]:
+        """Translate a spec entry into SubmitJob arguments."""
+        request = {
+            'jobName': job['name'],
+            'jobQueue': job.get('jobQueue', defaults.get('jobQueue')),
+            'jobDefinition': job.get('jobDefinition', defaults.get('jobDefinition')),
+        }
+        if not request['jobQueue'] or not request['jobDefinition']:
+            raise SpecError(f"Job {job['name']} needs a jobQueue and jobDefinition")
+
+        environment = dict(defaults.get('environment', {}))
+        environment.update(job.get('environment', {}))
+
+        overrides = {}
+        if environment:
+            overrides['environment'] = [
+                {'name': k, 'value': str(v)} for k, v in environment.items()
+            ]
+
+        resources = []
+        if job.get('vcpu'):
+            resources.append({'type': 'VCPU', 'value': str(job['vcpu'])})
+        if job.get('memory'):
+            resources.append({'type': 'MEMORY', 'value': str(job['memory'])})
+        if resources:
+            overrides['resourceRequirements'] = resources
+
+        if job.get('command'):
+            overrides['command'] = job['command']
+
+        if overrides:
+            request['containerOverrides'] = overrides
+
+        parameters = dict(defaults.get('parameters', {}))
+        parameters.update(job.get('parameters', {}))
+        if parameters:
+            request['parameters'] = {k: str(v) for k, v in parameters.items()}
+
+        if job.get('arraySize'):
+            request['arrayProperties'] = {'size': int(job['arraySize'])}
+
+        depends_on = []
+        for dependency in job.get('dependsOn', []):
+            entry = {'jobId': job_ids[_dependency_name(dependency)]}
+            if isinstance(dependency, dict) and dependency.get('type'):
+                entry['type'] = dependency['type']
+            depends_on.append(entry)
+        if depends_on:
+            request['dependsOn'] = depends_on
+
+        timeout = job.get('timeout', defaults.get('timeout'))
+        if timeout:
+            request['timeout'] = {'attemptDurationSeconds': int(timeout)}
+
+        if job.get('retryAttempts'):
+            request['retryStrategy'] = {'attempts': int(job['retryAttempts'])}
+
+        return request
+
+    def submit(self, spec: Dict[str, Any]) -> Dict[str, str]:
+        """
+        Submit every job in a spec, wave by wave.
+
+        Any error submitting a single job, including a malformed entry,
+        marks that job (and its dependents) as failed without stopping
+        the rest of the submission.
+
+        Args:
+            spec: Batch spec
+
+        Returns:
+            Mapping of job name to job ID for submitted jobs (also kept
+            in self.job_ids as submission progresses)
+
+        Raises:
+            SpecError: If the dependency graph is invalid
+        """
+        waves = plan_waves(spec.get('jobs', []))
+        defaults = {k: v for k, v in spec.items() if k != 'jobs'}
+        job_ids = self.job_ids
+        failed = set()
+
+        logger.info(f"Submitting {sum(len(w) for w in waves)} jobs in {len(waves)} waves")
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for number, wave in enumerate(waves, start=1):
+                # Jobs whose dependencies failed to submit cannot be submitted
+                runnable = []
+                for job in wave:
+                    if any(_dependency_name(d) in failed for d in job.get('dependsOn', [])):
+                        logger.error(f"Skipping {job['name']}: a dependency was not submitted")
+                        failed.add(job['name'])
+                        self._count('failed')
+                    else:
+                        runnable.append(job)
+
+                futures = {}
+                for job in runnable:
+                    try:
+                        request = self._build_request(job, defaults, job_ids)
+                    except (SpecError, KeyError, TypeError, ValueError) as e:
+                        logger.error(f"Invalid job {job['name']}: {e}")
+                        failed.add(job['name'])
+                        self._count('failed')
+                        continue
+                    futures[job['name']] = executor.submit(self._call, 'submit_job', **request)
+
+                submitted = 0
+                for name, future in futures.items():
+                    try:
+                        job_ids[name] = future.result()['jobId']
+                        submitted += 1
+                        self._count('submitted')
+                    except Exception as e:
+                        logger.error(f"Failed to submit {name}: {e}")
+                        failed.add(name)
+                        self._count('failed')
+
+                logger.info(f"Wave {number}/{len(waves)}: {submitted}/{len(wave)} jobs submitted")
+
+        return job_ids
+
+    def describe(self, job_ids: List[str]) -> Dict[str, str]:
+        """
+        Fetch job statuses in batched DescribeJobs calls.
+
+        Args:
+            job_ids: Job IDs to describe
+
+        Returns:
+            Mapping of job ID to status
+        """
+        batches = [
+            job_ids[i:i + DESCRIBE_BATCH_SIZE]
+            for i in range(0, len(job_ids), DESCRIBE_BATCH_SIZE)
+        ]
+        statuses = {}
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for response in executor.map(lambda batch: self._call('describe_jobs', jobs=batch), batches):
+                for job in response['jobs']:
+                    statuses[job['jobId']] = job['status']
+
+        return statuses
+
+    def wait(self, job_ids: List[str], interval: float = 30.0,
+             timeout: float = None) -> Dict[str, str]:
+        """
+        Poll until every job reaches a terminal status.
+
+        Jobs DescribeJobs stops returning are reported as UNKNOWN after
+        MISSING_POLL_LIMIT consecutive polls instead of being polled forever.
+
+        Args:
+            job_ids: Job IDs to wait for
+            interval: Seconds between polls
+            timeout: Give up after this many seconds (optional)
+
+        Returns:
+            Mapping of job ID to last seen status (UNKNOWN if never seen)
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        statuses = {job_id: 'UNKNOWN' for job_id in job_ids}
+        missing = {job_id: 0 for job_id in job_ids}
+        pending = list(job_ids)
+
+        while pending:
+            described = self.describe(pending)
+            statuses.update(described)
+            for job_id in pending:
+                missing[job_id] = 0 if job_id in described else missing[job_id] + 1
+                if missing[job_id] == MISSING_POLL_LIMIT:
+                    logger.warning(f"Job {job_id} is no longer returned by DescribeJobs")
+                    statuses[job_id] = 'UNKNOWN'
+            pending = [
+                j for j in pending
+                if statuses[j] not in TERMINAL_STATUSES and missing[j] < MISSING_POLL_LIMIT
+            ]
+
+            counts = {}
+            for status in statuses.values():
+                counts[status] = counts.get(status, 0) + 1
+            logger.info(f"Job statuses: {counts}")
+
+            if not pending or (deadline and time.monotonic() >= deadline):
+                break
+            time.sleep(interval)
+
+        return statuses
+
+
+def create_client(region: str, concurrency: int, endpoint_url: str = None):
+    """
+    Create a Batch client sized for concurrent use.
+
+    Botocore's own retries are disabled so that throttling, server errors and
+    dropped connections are retried once, by the submitter's backoff.
+
+    Args:
+        region: AWS region
+        concurrency: Number of threads sharing the client
+        endpoint_url: Alternative endpoint, e.g. a local API stub
+
+    Returns:
+        boto3 Batch client
+    """
+    config = Config(
+        max_pool_connections=concurrency,
+        retries={'max_attempts': 1, 'mode': 'standard'}
+    )
+    return boto3.client('batch', region_name=region, endpoint_url=endpoint_url, config=config)
+
+
+def main():
+    """Main entry point for CLI."""
+    parser = argparse.ArgumentParser(
+        description='Submit a batch spec of AWS Batch jobs concurrently'
+    )
+
+    parser.add_argument(
+        'spec',
+        help='Path to the JSON batch spec'
+    )
+
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=16,
+        help='Maximum in-flight API calls (default: 16)'
+    )
+
+    parser.add_argument(
+        '--rate',
+        type=float,
+        default=10.0,
+        help='Maximum API calls per second (default: 10)'
+    )
+
+    parser.add_argument(
+        '--burst',
+        type=int,
+        default=None,
+        help='Token bucket burst size (default: one second of --rate)'
+    )
+
+    parser.add_argument(
+        '--max-retries',
+        type=int,
+        default=8,
+        help='Retries per call when throttled (default: 8)'
+    )
+
+    parser.add_argument(
+        '--wait',
+        action='store_true',
+        help='Poll until all submitted jobs finish'
+    )
+
+    parser.add_argument(
+        '--poll-interval',
+        type=float,
+        default=30.0,
+        help='Seconds between status polls (default: 30)'
+    )
+
+    parser.add_argument(
+        '--wait-timeout',
+        type=float,
+        default=None,
+        help='Stop waiting after this many seconds (default: no limit)'
+    )
+
+    parser.add_argument(
+        '--region',
+        default=os.getenv('AWS_REGION', 'us-east-1'),
+        help='AWS region (default: AWS_REGION or us-east-1)'
+    )
+
+    parser.add_argument(
+        '--endpoint-url',
+        default=None,
+        help='Batch API endpoint override, e.g. a local stub'
+    )
+
+    parser.add_argument(
+        '--output',
+        default=None,
+        help='Write the job name to job ID mapping to this file'
+    )
+
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        stream=sys.stdout
+    )
+
+    client = create_client(args.region, args.concurrency, args.endpoint_url)
+    submitter = BatchSubmitter(
+        client,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        burst=args.burst,
+        max_retries=args.max_retries
+    )
+
+    try:
+        submitter.submit(load_spec(args.spec))
+    except SpecError as e:
+        logger.error(f"Invalid spec: {e}")
+        sys.exit(1)
+    finally:
+        # Jobs already submitted are live in AWS: always record them
+        job_ids = submitter.job_ids
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(job_ids, f, indent=2)
+        else:
+            print(json.dumps(job_ids, indent=2))
+
+    logger.info(f"Submission metrics: {submitter.metrics}")
+
+    exit_code = 1 if submitter.metrics['failed'] else 0
+
+    if args.wait and job_ids:
+        statuses = submitter.wait(
+            list(job_ids.values()),
+            interval=args.poll_interval,
+            timeout=args.wait_timeout
+        )
+        if any(status != 'SUCCEEDED' for status in statuses.values()):
+            exit_code = 1
+
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()